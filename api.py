@@ -0,0 +1,174 @@
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from cache import UserIdentity, user_cache
+from database import get_db
+from library import feed_tracks_query, paginate, remove_tracks, user_tracks_query
+from models import Feed, Track, feed_tracks
+from search import search_terms
+from tokens import make_token, verify_token
+
+LIBRARY_LINK_TTL = 7 * 24 * 3600
+MAX_PAGE_SIZE = 100
+MAX_BULK_DELETE = 500
+
+router = APIRouter(prefix="/api")
+
+
+def library_token(user_uuid: str, ttl: int = LIBRARY_LINK_TTL) -> str:
+    """Signed token that gives the web UI access to all feeds of the user"""
+    return make_token(user_uuid, ttl, purpose='library')
+
+
+class FeedOut(BaseModel):
+    uuid: str
+    title: Optional[str]
+    profile: str
+    track_count: int
+    current: bool
+    rss_url: str
+
+
+class TrackOut(BaseModel):
+    id: int
+    title: str
+    channel: Optional[str]
+    url: Optional[str]
+    duration: Optional[int]
+    file_size: Optional[int]
+    created_at: datetime
+    audio_url: str
+
+
+class TrackPage(BaseModel):
+    items: list[TrackOut]
+    next_cursor: Optional[str]
+
+
+class DeleteRequest(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=MAX_BULK_DELETE)
+
+
+class DeleteResult(BaseModel):
+    deleted: list[int]
+
+
+def get_user(authorization: str = Header(default=''), db: Session = Depends(get_db)) -> UserIdentity:
+    """User of the `Authorization: Bearer <token>` header, the token comes from the bot's /web"""
+    scheme, _, token = authorization.partition(' ')
+    user_uuid = verify_token(token, purpose='library') if scheme.lower() == 'bearer' else None
+    user = user_cache.get_by_uuid(db, user_uuid) if user_uuid else None
+    if not user:
+        raise HTTPException(status_code=401, detail="Library link is invalid or expired")
+    return user
+
+
+def get_user_feed(feed_uuid: str, user: UserIdentity, db: Session) -> Feed:
+    feed = db.query(Feed).filter_by(uuid=feed_uuid, user_id=user.id).first()
+    if not feed:
+        raise HTTPException(status_code=404, detail="Feed not found")
+    return feed
+
+
+@router.get("/feeds", response_model=list[FeedOut])
+def list_feeds(user: UserIdentity = Depends(get_user), db: Session = Depends(get_db)):
+    track_counts = dict(
+        db.query(feed_tracks.c.feed_id, func.count())
+        .join(Feed, Feed.id == feed_tracks.c.feed_id)
+        .filter(Feed.user_id == user.id)
+        .group_by(feed_tracks.c.feed_id)
+    )
+    domain = os.getenv("DOMAIN")
+    feeds = db.query(Feed).filter_by(user_id=user.id).order_by(Feed.id).all()
+    # The default feed is current until the user picks another one
+    current_id = user.current_feed_id or next((feed.id for feed in feeds if feed.uuid == user.uuid), None)
+    return [
+        FeedOut(
+            uuid=feed.uuid,
+            title=feed.title,
+            profile=feed.profile,
+            track_count=track_counts.get(feed.id, 0),
+            current=feed.id == current_id,
+            rss_url=f"https://{domain}/rss/{feed.uuid}",
+        )
+        for feed in feeds
+    ]
+
+
+def track_page(tracks: list[Track], next_cursor: Optional[str], user: UserIdentity) -> TrackPage:
+    domain = os.getenv("DOMAIN")
+    return TrackPage(
+        items=[
+            TrackOut(
+                id=track.id,
+                title=track.title,
+                channel=track.channel_name,
+                url=track.youtube_url,
+                duration=track.duration,
+                file_size=track.file_size,
+                created_at=track.created_at,
+                audio_url=f"https://{domain}/audio/{user.uuid}/{track.file_name}",
+            )
+            for track in tracks
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+def get_page(query, limit: int, cursor: Optional[str]) -> tuple:
+    try:
+        return paginate(query, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/feeds/{feed_uuid}/tracks", response_model=TrackPage)
+def list_tracks(
+    feed_uuid: str,
+    limit: int = Query(default=50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    q: Optional[str] = Query(default=None, max_length=200),
+    user: UserIdentity = Depends(get_user),
+    db: Session = Depends(get_db),
+):
+    """Tracks of the feed, newest first; pass `next_cursor` back as `cursor` for the next page"""
+    feed = get_user_feed(feed_uuid, user, db)
+    tracks, next_cursor = get_page(feed_tracks_query(db, feed.id, q), limit, cursor)
+    return track_page(tracks, next_cursor, user)
+
+
+@router.get("/search", response_model=TrackPage)
+def search(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user: UserIdentity = Depends(get_user),
+    db: Session = Depends(get_db),
+):
+    """Tracks of all the user's feeds whose title, channel or description match `q`, newest first"""
+    if not search_terms(q):
+        return TrackPage(items=[], next_cursor=None)
+    tracks, next_cursor = get_page(user_tracks_query(db, user.id, q), limit, cursor)
+    return track_page(tracks, next_cursor, user)
+
+
+@router.post("/feeds/{feed_uuid}/tracks/delete", response_model=DeleteResult)
+def delete_tracks(feed_uuid: str, request: DeleteRequest, user: UserIdentity = Depends(get_user),
+                  db: Session = Depends(get_db)):
+    """Remove tracks from the feed; ids that aren't in the feed are skipped"""
+    feed = get_user_feed(feed_uuid, user, db)
+    tracks = (
+        db.query(Track)
+        .join(feed_tracks)
+        .filter(feed_tracks.c.feed_id == feed.id, Track.id.in_(set(request.ids)))
+        .all()
+    )
+    deleted = [track.id for track in tracks]
+    remove_tracks(db, user.uuid, feed, tracks)
+    return DeleteResult(deleted=deleted)
@@ -0,0 +1,98 @@
+"""Fill duration, bitrate and file_size for tracks created before they were stored.
+
+Usage:
+    python backfill.py [--workers 8] [--batch-size 200]
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import mutagen
+from dotenv import load_dotenv
+from sqlalchemy import or_
+from sqlalchemy.orm import sessionmaker
+
+from logs import setup_logging
+from models import Track, User, init_db
+
+logger = logging.getLogger(__name__)
+
+
+def probe(file_path: str) -> dict:
+    """Read duration, bitrate and size from an audio file"""
+    audio = mutagen.File(file_path)
+    if audio is None:
+        raise ValueError("Unknown audio format")
+    return {
+        'duration': int(audio.info.length),
+        'bitrate': getattr(audio.info, 'bitrate', None),
+        'file_size': os.path.getsize(file_path),
+    }
+
+
+def _probe_track(item: tuple[int, str]) -> tuple[int, dict | None]:
+    track_id, file_path = item
+    try:
+        return track_id, probe(file_path)
+    except Exception as e:
+        logger.warning(f"Can't probe {file_path}: {e}")
+        return track_id, None
+
+
+def backfill(session_factory: sessionmaker, workers: int, batch_size: int) -> tuple[int, int]:
+    """Probe tracks with missing metadata in parallel and store the results
+
+    Returns:
+        tuple: Number of updated and failed tracks
+    """
+    updated = failed = 0
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            session = session_factory()
+            try:
+                rows = (
+                    session.query(Track.id, User.uuid, Track.file_name)
+                    .join(User)
+                    .filter(Track.id > last_id)
+                    .filter(or_(Track.duration.is_(None), Track.bitrate.is_(None), Track.file_size.is_(None)))
+                    .order_by(Track.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not rows:
+                    break
+                last_id = rows[-1].id
+
+                items = [(row.id, f"data/{row.uuid}/{row.file_name}") for row in rows]
+                for track_id, values in pool.map(_probe_track, items):
+                    if values is None:
+                        failed += 1
+                        continue
+                    session.query(Track).filter_by(id=track_id).update(values)
+                    updated += 1
+                session.commit()
+                logger.info(f"Backfilled {updated} tracks ({failed} failed)")
+            finally:
+                session.close()
+    return updated, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8, help="parallel probes")
+    parser.add_argument('--batch-size', type=int, default=200, help="tracks per transaction")
+    args = parser.parse_args()
+
+    load_dotenv()
+    setup_logging()
+    engine = init_db(os.getenv("DATABASE_URL"))
+    updated, failed = backfill(sessionmaker(bind=engine), args.workers, args.batch_size)
+    logger.info(f"Done: {updated} updated, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
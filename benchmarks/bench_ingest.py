@@ -0,0 +1,176 @@
+"""Times the ingest pipeline (download, publish, Track insert) end to end.
+
+Modes:
+    stub   - yt-dlp is replaced by a fake that copies a local MP3 fixture and
+             fires the same progress/postprocessor hooks; measures our own
+             overhead (coalescing, publishing, DB) without network or ffmpeg
+    local  - real yt-dlp and ffmpeg on local media fixtures through file://
+             URLs; needs ffmpeg in PATH
+
+Usage:
+    python benchmarks/bench_ingest.py [--mode stub] [--videos 20] [--requests-per-video 3]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import time
+import types
+
+from common import Report, add_common_arguments, make_mp3, seed, setup_workspace, summarize
+
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL: "downloads" the fixture into outtmpl"""
+
+    fixture = None
+    download_delay = 0.0
+
+    def __init__(self, opts: dict):
+        self.opts = opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url: str, download: bool = True) -> dict:
+        video_id = url.rsplit('/', 1)[-1]
+        out_dir = os.path.dirname(self.opts['outtmpl'])
+        os.makedirs(out_dir, exist_ok=True)
+        size = os.path.getsize(self.fixture)
+        for hook in self.opts.get('progress_hooks', []):
+            hook({'status': 'downloading', 'downloaded_bytes': size // 2, 'total_bytes': size, 'speed': 1e6, 'eta': 1})
+        time.sleep(self.download_delay)
+        pp = {'postprocessor': 'ExtractAudio', 'info_dict': {}}
+        for hook in self.opts.get('postprocessor_hooks', []):
+            hook({**pp, 'status': 'started'})
+        shutil.copyfile(self.fixture, f"{out_dir}/{video_id}.mp3")
+        for hook in self.opts.get('postprocessor_hooks', []):
+            hook({**pp, 'status': 'finished'})
+        return {'id': video_id, 'title': f"Video {video_id}", 'duration': 60, 'channel': 'Bench'}
+
+
+class _Message:
+    message_id = 0
+
+    async def edit_text(self, text):
+        pass
+
+    async def delete(self):
+        pass
+
+
+class _TelegramBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        return _Message()
+
+
+async def ingest_all(podcast_bot, session_factory, users: list, urls: list, requests_per_video: int) -> list:
+    from ingest import DEFAULT_PROFILE
+    from models import DownloadJob
+    from sources import classify_url
+    import uuid
+
+    samples = []
+
+    async def one(user, url):
+        source = classify_url(url)
+        session = session_factory()
+        try:
+            job = DownloadJob(
+                user_id=user.id, chat_id=user.telegram_id, url=url,
+                video_key=source.key if source else uuid.uuid5(uuid.NAMESPACE_URL, url).hex,
+                extractor=source.extractor if source else 'generic',
+                profile=DEFAULT_PROFILE, language='en',
+            )
+            session.add(job)
+            session.commit()
+            t0 = time.perf_counter()
+            await podcast_bot._ingest(session, job)
+            samples.append(time.perf_counter() - t0)
+        finally:
+            session.close()
+
+    await asyncio.gather(*(
+        one(users[i % len(users)], url)
+        for url in urls
+        for i in range(requests_per_video)
+    ))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the ingest pipeline")
+    add_common_arguments(parser)
+    parser.add_argument('--mode', choices=['stub', 'local'], default='stub')
+    parser.add_argument('--videos', type=int, default=20)
+    parser.add_argument('--requests-per-video', type=int, default=3, help="concurrent requests per video, by different users")
+    parser.add_argument('--audio-seconds', type=float, default=600)
+    parser.add_argument('--download-delay', type=float, default=0.0, help="simulated network time per download (stub)")
+    args = parser.parse_args()
+
+    workspace = setup_workspace(args)
+    from sqlalchemy.orm import sessionmaker
+    import bot as bot_module
+    from ingest import SingleFlight
+    from sources import ExtractorLimits
+    from models import User, init_db
+
+    engine = init_db(os.environ['DATABASE_URL'])
+    Session = sessionmaker(bind=engine)
+    seed(Session, args.requests_per_video, 0)
+
+    os.makedirs('fixtures', exist_ok=True)
+    fixture = os.path.join(workspace, 'fixtures', 'source.mp3')
+    with open(fixture, 'wb') as f:
+        f.write(make_mp3(args.audio_seconds))
+
+    if args.mode == 'stub':
+        import yt_dlp
+        FakeYoutubeDL.fixture = fixture
+        FakeYoutubeDL.download_delay = args.download_delay
+        yt_dlp.YoutubeDL = FakeYoutubeDL
+        urls = [f"https://bench.local/{n:011d}" for n in range(args.videos)]
+    else:
+        if not shutil.which('ffmpeg'):
+            parser.error("--mode local needs ffmpeg in PATH")
+        import yt_dlp
+
+        class LocalYoutubeDL(yt_dlp.YoutubeDL):
+            def __init__(self, params=None, *a, **kw):
+                super().__init__({**(params or {}), 'enable_file_urls': True}, *a, **kw)
+
+        yt_dlp.YoutubeDL = LocalYoutubeDL
+        urls = []
+        for n in range(args.videos):
+            path = os.path.join(workspace, 'fixtures', f"video{n:04d}.mp3")
+            shutil.copyfile(fixture, path)
+            urls.append(f"file://{path}")
+
+    # PodcastBot without a Telegram connection
+    podcast_bot = bot_module.PodcastBot.__new__(bot_module.PodcastBot)
+    podcast_bot.application = types.SimpleNamespace(bot=_TelegramBot())
+    podcast_bot.session_factory = Session
+    podcast_bot.admin_id = 0
+    podcast_bot.flights = SingleFlight()
+    # Every video downloads at once; the benchmark measures the rest of the pipeline
+    podcast_bot.limits = ExtractorLimits(default=(len(urls), 0))
+    podcast_bot._downloads = {}
+    podcast_bot._background_tasks = set()
+
+    session = Session()
+    users = session.query(User).all()
+    session.close()
+
+    report = Report(args)
+    start = time.perf_counter()
+    samples = asyncio.run(ingest_all(podcast_bot, Session, users, urls, args.requests_per_video))
+    result = summarize(samples, time.perf_counter() - start)
+    report.add(f"ingest.{args.mode}[{args.videos}x{args.requests_per_video}]", result)
+    report.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark of the locale render path.
+
+Compares get_text against the previous implementation (dict lookups with
+English fallback + str.format on every call) for the keys the bot renders
+most, single-threaded and from a pool of worker threads.
+
+Usage:
+    python benchmarks/bench_locales.py [--iterations 200000] [--threads 8]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import locales  # noqa: E402
+
+CALLS = [
+    ('ru', 'download_progress', {'percent': '42%', 'speed': '1.2 MB/s', 'eta': '0:31'}),
+    ('en', 'download_success', {'title': 'Some video title'}),
+    ('ru-RU', 'track_item', {'number': 7, 'title': 'Some video title', 'url': 'https://youtu.be/dQw4w9WgXcQ'}),
+    ('en', 'help', {}),
+    ('de', 'start_first', {}),
+    ('ru', 'feed_channel', {'channel': 'Channel'}),
+]
+
+
+def legacy_get_text(language_code: str, key: str, **kwargs) -> str:
+    locale = locales.LOCALES.get(language_code, locales.LOCALES['en'])
+    text = locale.translations.get(key, locales.LOCALES['en'].translations.get(key, key))
+    return text.format(**kwargs) if kwargs else text
+
+
+def run(get_text, iterations: int) -> float:
+    calls = CALLS
+    n = len(calls)
+    start = time.perf_counter()
+    for i in range(iterations):
+        lang, key, kwargs = calls[i % n]
+        get_text(lang, key, **kwargs)
+    return time.perf_counter() - start
+
+
+def report(name: str, iterations: int, elapsed: float):
+    print(f"{name:<32} {iterations / elapsed:>12,.0f} renders/s  {elapsed / iterations * 1e9:>8.0f} ns/render")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark locale rendering")
+    parser.add_argument('--iterations', type=int, default=200_000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    for lang, key, kwargs in CALLS:
+        assert locales.get_text(lang, key, **kwargs) == legacy_get_text(locales.normalize_language(lang), key, **kwargs)
+
+    report("legacy get_text", args.iterations, run(legacy_get_text, args.iterations))
+    report("get_text", args.iterations, run(locales.get_text, args.iterations))
+
+    per_thread = args.iterations // args.threads
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda _: run(locales.get_text, per_thread), range(args.threads)))
+        elapsed = time.perf_counter() - start
+    report(f"get_text, {args.threads} threads", per_thread * args.threads, elapsed)
+
+    # Same, with hot reload enabled (mtime checks throttled by the loader)
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'ru.json'), 'w', encoding='utf-8') as f:
+            f.write('{"start_first": "Сначала /start"}')
+        locales._loader = locales.CatalogLoader(directory, interval=1.0)
+        report("get_text, hot reload on", args.iterations, run(locales.get_text, args.iterations))
+        locales._loader = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Micro-benchmarks of the hot helpers: create_rss_feed, process_podcast_cover,
+calculate_user_storage and full-text search.
+
+Usage:
+    python benchmarks/bench_micro.py [--tracks 500] [--repeat 50]
+"""
+import argparse
+import os
+
+from common import Report, add_common_arguments, make_jpeg, seed, setup_workspace, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of feed and storage helpers")
+    add_common_arguments(parser)
+    parser.add_argument('--tracks', type=int, default=500, help="tracks in the benchmarked feed")
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_workspace(args)
+    from sqlalchemy.orm import sessionmaker
+    from models import Feed, Track, init_db
+    from library import user_tracks_query
+    from server import create_rss_feed
+    from utils import calculate_user_storage, process_podcast_cover
+
+    engine = init_db(os.environ['DATABASE_URL'])
+    Session = sessionmaker(bind=engine)
+    [user_uuid] = seed(Session, 1, args.tracks)
+
+    session = Session()
+    try:
+        feed = session.query(Feed).filter_by(uuid=user_uuid).one()
+        tracks = session.query(Track).filter(Track.feeds.contains(feed)).order_by(Track.created_at.desc()).all()
+        report = Report(args)
+
+        report.add(f"create_rss_feed[{args.tracks}]", time_calls(lambda: create_rss_feed(feed, tracks, 'bench.local'), args.repeat))
+        report.add(f"calculate_user_storage[{args.tracks}]", time_calls(lambda: calculate_user_storage(user_uuid), args.repeat))
+        user_id = feed.user_id
+        for query in ('episode 1', 'reasonably long', 'nothing'):
+            report.add(f"search[{args.tracks}, {query!r}]",
+                       time_calls(lambda: user_tracks_query(session, user_id, query).limit(10).all(), args.repeat))
+        for size in (512, 1400, 3000):
+            image = make_jpeg(size, size)
+            report.add(f"process_podcast_cover[{size}px]",
+                       time_calls(lambda: process_podcast_cover(image, '@bench_user'), max(1, args.repeat // 5)))
+        report.save()
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Load test of feed serving: /rss/{uuid}, /audio (full and Range) and /image.
+
+Seeds synthetic users and tracks, starts the FastAPI app under uvicorn in a
+separate process (so the load generator doesn't share its CPU) and hits each
+endpoint with a fixed number of concurrent clients.
+
+Usage:
+    python benchmarks/bench_server.py [--users 20] [--tracks 200] [--concurrency 32] [--duration 10]
+    python benchmarks/bench_server.py --json baseline.json
+    python benchmarks/bench_server.py --baseline baseline.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from common import ROOT, Report, add_common_arguments, seed, setup_workspace, summarize
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int) -> subprocess.Popen:
+    env = {**os.environ, 'PYTHONPATH': ROOT}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--port', str(port), '--log-level', 'warning', '--no-access-log'],
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server didn't start")
+
+
+async def load(client: httpx.AsyncClient, make_request, concurrency: int, duration: float) -> dict:
+    samples = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            url, headers = make_request()
+            t0 = time.perf_counter()
+            response = await client.get(url, headers=headers)
+            samples.append(time.perf_counter() - t0)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(samples, time.perf_counter() - start)
+    result['errors'] = errors
+    return result
+
+
+async def run(args, uuids: list, base_url: str, report: Report):
+    rng = random.Random(42)
+    audio_size = os.path.getsize('data/fixture.mp3')
+
+    def rss():
+        return f"/rss/{rng.choice(uuids)}", {}
+
+    def audio_full():
+        return f"/audio/{rng.choice(uuids)}/bench{rng.randrange(args.tracks):06d}.mp3", {}
+
+    def audio_range():
+        start = rng.randrange(max(1, audio_size - 65536))
+        return (f"/audio/{rng.choice(uuids)}/bench{rng.randrange(args.tracks):06d}.mp3",
+                {'Range': f"bytes={start}-{start + 65535}"})
+
+    def image():
+        return f"/image/{rng.choice(uuids)}.jpg", {}
+
+    scenarios = {'rss': rss, 'audio': audio_full, 'audio_range': audio_range, 'image': image}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        for name, make_request in scenarios.items():
+            if args.only and name not in args.only:
+                continue
+            result = await load(client, make_request, args.concurrency, args.duration)
+            report.add(f"http.{name}", result)
+            if result['errors']:
+                print(f"  {result['errors']} error responses", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test feed serving endpoints")
+    add_common_arguments(parser)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--tracks', type=int, default=200, help="tracks per user")
+    parser.add_argument('--audio-seconds', type=float, default=300, help="length of the audio fixture")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10, help="seconds per endpoint")
+    parser.add_argument('--only', nargs='*', help="rss, audio, audio_range, image")
+    args = parser.parse_args()
+
+    workspace = setup_workspace(args)
+    from sqlalchemy.orm import sessionmaker
+    from models import init_db
+
+    print(f"Seeding {args.users} users x {args.tracks} tracks in {workspace}", flush=True)
+    engine = init_db(os.environ['DATABASE_URL'])
+    uuids = seed(sessionmaker(bind=engine), args.users, args.tracks, args.audio_seconds)
+    engine.dispose()
+
+    port = free_port()
+    process = start_server(port)
+    report = Report(args)
+    try:
+        asyncio.run(run(args, uuids, f"http://127.0.0.1:{port}", report))
+    finally:
+        process.terminate()
+        process.wait()
+    report.save()
+
+
+if __name__ == "__main__":
+    main()
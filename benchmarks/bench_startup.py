@@ -0,0 +1,76 @@
+"""Startup time: module import cost and time until the feed server answers.
+
+Each measurement runs in a fresh interpreter, so nothing is cached in
+sys.modules. "serve" is the wall time from spawning uvicorn with the app
+until the first successful HTTP response (DB init included).
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--modules server bot main]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from common import ROOT, Report, add_common_arguments, setup_workspace, summarize
+from bench_server import free_port
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {module}; print('import_seconds', time.perf_counter() - t)"
+
+
+def time_import(module: str, env: dict) -> float:
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SNIPPET.format(module=module)],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    # The app may log to stdout as well
+    [line] = [line for line in output.splitlines() if line.startswith('import_seconds ')]
+    return float(line.split()[1])
+
+
+def time_to_serve(env: dict) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--port', str(port), '--log-level', 'warning'],
+        env=env,
+    )
+    try:
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/rss/startup-probe", timeout=1)
+                return time.perf_counter() - start
+            except httpx.TransportError:
+                if process.poll() is not None:
+                    raise RuntimeError("Server exited during startup")
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure startup time")
+    add_common_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--modules', nargs='*', default=['server', 'bot', 'main'])
+    args = parser.parse_args()
+
+    setup_workspace(args)
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'TELEGRAM_BOT_TOKEN': '0:startup-benchmark', 'ADMIN_ID': '0'}
+    report = Report(args)
+
+    for module in args.modules:
+        samples = [time_import(module, env) for _ in range(args.repeat)]
+        report.add(f"import.{module}", summarize(samples, sum(samples)))
+
+    samples = [time_to_serve(env) for _ in range(args.repeat)]
+    report.add("serve.first_response", summarize(samples, sum(samples)))
+    report.save()
+
+
+if __name__ == "__main__":
+    main()
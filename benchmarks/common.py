@@ -0,0 +1,172 @@
+"""Shared helpers for the benchmark scripts.
+
+The app uses paths relative to the working directory (`data/{uuid}/...`)
+and reads DATABASE_URL from the environment, so every benchmark first
+calls `setup_workspace`, which switches to a scratch directory and points
+the app at a database there (or at `--database-url`).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz frame header; 417 bytes per frame, 26 ms of audio
+_MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0x64]) + b'\x00' * 413
+
+
+def add_common_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--database-url', help="database to seed and use (default: SQLite in the workspace)")
+    parser.add_argument('--workspace', help="working directory for data/ (default: temporary)")
+    parser.add_argument('--json', dest='json_path', help="write results to this JSON file")
+    parser.add_argument('--baseline', help="compare against results saved with --json")
+
+
+def setup_workspace(args) -> str:
+    """Switch to the benchmark workspace and configure the app's environment"""
+    for name in ('json_path', 'baseline'):
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    workspace = os.path.abspath(args.workspace) if args.workspace else tempfile.mkdtemp(prefix='y2p-bench-')
+    os.makedirs(workspace, exist_ok=True)
+    os.chdir(workspace)
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{workspace}/bench.db"
+    os.environ.setdefault('DOMAIN', 'bench.local')
+    # Load generators send everything from one address and user; measure the app, not the limiters
+    for name in ('RATE_LIMIT_BOT', 'RATE_LIMIT_INGEST', 'RATE_LIMIT_HTTP', 'RATE_LIMIT_UUID'):
+        os.environ.setdefault(name, '0')
+    return workspace
+
+
+def make_mp3(seconds: float) -> bytes:
+    """Silent but valid MP3 of roughly the given length"""
+    return _MP3_FRAME * max(1, int(seconds / 0.026))
+
+
+def make_jpeg(width: int = 1400, height: int = 1400) -> bytes:
+    from PIL import Image
+    image = Image.new('RGB', (width, height))
+    pixels = image.load()
+    rng = random.Random(1)
+    for x in range(0, width, 8):
+        for y in range(0, height, 8):
+            pixels[x, y] = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def seed(session_factory, users: int, tracks_per_user: int, audio_seconds: float = 60.0) -> list:
+    """Create synthetic users with tracks, audio files and covers
+
+    Files are hard links of one fixture, so large libraries are cheap to
+    seed. Returns the created users' uuids.
+    """
+    from models import Feed, Track, User
+
+    os.makedirs('data', exist_ok=True)
+    fixture = 'data/fixture.mp3'
+    with open(fixture, 'wb') as f:
+        f.write(make_mp3(audio_seconds))
+    file_size = os.path.getsize(fixture)
+    cover = make_jpeg(512, 512)
+
+    session = session_factory()
+    uuids = []
+    now = datetime.now(timezone.utc)
+    try:
+        start_id = session.query(User).count()
+        for i in range(users):
+            user = User(telegram_id=10_000_000 + start_id + i, username=f"bench_user_{start_id + i}",
+                        uuid=str(uuid.uuid4()), image=True)
+            feed = Feed(user=user, uuid=user.uuid, image=True)
+            session.add_all([user, feed])
+            session.flush()
+            user.current_feed_id = feed.id
+            user_dir = f"data/{user.uuid}"
+            os.makedirs(user_dir, exist_ok=True)
+            with open(f"{user_dir}/image.jpg", 'wb') as f:
+                f.write(cover)
+            for n in range(tracks_per_user):
+                file_name = f"bench{n:06d}.mp3"
+                os.link(fixture, f"{user_dir}/{file_name}")
+                session.add(Track(
+                    user_id=user.id,
+                    title=f"Synthetic episode {n} with a reasonably long title",
+                    youtube_url=f"https://youtu.be/bench{n:06d}",
+                    file_name=file_name,
+                    created_at=now - timedelta(hours=n),
+                    duration=int(audio_seconds),
+                    bitrate=128000,
+                    file_size=file_size,
+                    channel_name=f"Channel {n % 50}",
+                    description="Synthetic description. " * 20,
+                    feeds=[feed],
+                ))
+            uuids.append(user.uuid)
+            session.commit()
+    finally:
+        session.close()
+    return uuids
+
+
+def percentile(samples: list, p: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """Throughput and latency percentiles (ms) of per-operation timings in seconds"""
+    return {
+        'ops': len(samples),
+        'ops_per_sec': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000,
+    }
+
+
+def time_calls(fn, repeat: int) -> dict:
+    samples = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - start)
+
+
+class Report:
+    """Collects named results, prints them and optionally compares with a baseline"""
+
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+        self.baseline = {}
+        if args.baseline:
+            with open(args.baseline) as f:
+                self.baseline = json.load(f)
+
+    def add(self, name: str, result: dict):
+        self.results[name] = result
+        line = f"{name:<40} {result['ops_per_sec']:>10,.1f} ops/s  p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms"
+        base = self.baseline.get(name)
+        if base:
+            change = (result['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100 if base['p50_ms'] else 0.0
+            line += f"  (p50 {change:+.1f}% vs baseline)"
+        print(line, flush=True)
+
+    def save(self):
+        if self.args.json_path:
+            with open(self.args.json_path, 'w') as f:
+                json.dump(self.results, f, indent=2)
@@ -1,28 +1,50 @@
 import os
-import yt_dlp
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.helpers import escape_markdown
+from telegram.ext import (
+    Application, ApplicationHandlerStop, CallbackQueryHandler, CommandHandler, MessageHandler, TypeHandler, filters,
+    ContextTypes
+)
+from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker, Session
-from models import User, Track
+from models import User, Track, DownloadJob, Feed, feed_tracks
 import uuid
 import asyncio
+import json
+import math
 from datetime import datetime
 import logging
+from typing import Optional
 from utils import process_podcast_cover, calculate_user_storage, format_size
-from locales import get_text
-import mutagen
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from locales import get_text, normalize_language
+from cache import TTLCache, UserIdentity, feed_cache, user_cache
+from progress import DownloadProgress
+from metrics import DOWNLOADS_IN_FLIGHT, INGEST_WAITERS, INGESTS, timed_handler
+from logs import log_context
+from ratelimit import bot_limiter, ingest_limiter
+from janitor import reconcile_storage
+from integrity import IntegrityScanner
+from ingest import (
+    DEFAULT_PROFILE, PROFILES, SingleFlight, audio_metadata, download_audio, remove_staging, staging_dir,
+    track_file_name
 )
+from sources import ALLOWED_EXTRACTORS, ExtractorLimits, classify_url, find_url, is_allowed, is_youtube_url
+from library import feed_tracks_query, link_existing_track, remove_tracks, store_track, user_tracks_query
+from search import search_terms
+from api import library_token
+from uploads import UploadError, process_upload, upload_token
+
 logger = logging.getLogger(__name__)
 
+MAX_FEEDS = 10
+LIST_PAGE_SIZE = 10
+# Bots can't download larger files from Telegram, those go through the upload link
+TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
 
 def get_lang(update: Update) -> str:
     """Get user's language code or default to 'en'"""
-    return update.effective_user.language_code or 'en'
+    return normalize_language(update.effective_user.language_code)
 
 
 class PodcastBot:
@@ -34,6 +56,18 @@ class PodcastBot:
             self.domain = domain
             self.session_factory = session_factory
             self.admin_id = admin_id
+            # In-flight downloads keyed by (video id, profile), shared by all requesters
+            self.flights = SingleFlight()
+            # Per-site download queues, so a slow site doesn't hold up YouTube
+            self.limits = ExtractorLimits(os.getenv("EXTRACTOR_LIMITS", "youtube=4:30"))
+            DOWNLOADS_IN_FLIGHT.set_function(lambda: len(self.flights))
+            self._downloads = {}
+            self._background_tasks = set()
+            # Users told they are rate limited, so a flood gets one reply rather than one per message
+            self._rate_limit_notified = TTLCache(maxsize=10000, ttl=60.0)
+            # Checks data/ against the tracks table, results are shown by /stat
+            self.integrity = IntegrityScanner(session_factory, int(os.getenv("INTEGRITY_BATCH_SIZE", "100")))
+            self.integrity_interval = float(os.getenv("INTEGRITY_SCAN_INTERVAL", "3600"))
             self.setup_handlers()
             logger.info("PodcastBot initialized successfully")
         except Exception as e:
@@ -43,16 +77,32 @@ class PodcastBot:
     def setup_handlers(self):
         logger.info("Setting up message handlers...")
         try:
-            self.application.add_handler(CommandHandler("start", self.start_command))
-            self.application.add_handler(CommandHandler("help", self.help_command))
-            self.application.add_handler(CommandHandler("feed", self.feed_command))
-            self.application.add_handler(CommandHandler("list", self.list_command))
-            self.application.add_handler(CommandHandler("delete", self.delete_command))
-            self.application.add_handler(CommandHandler("setimage", self.set_image_command))
-            self.application.add_handler(MessageHandler(filters.PHOTO, self.handle_image))
-            self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_youtube_url))
+            # Runs before every other handler and stops the update if the user is over the limit
+            self.application.add_handler(TypeHandler(Update, self.check_rate_limit), group=-1)
+            self.application.add_handler(CommandHandler("start", timed_handler("start", log_context(self.start_command))))
+            self.application.add_handler(CommandHandler("help", timed_handler("help", log_context(self.help_command))))
+            self.application.add_handler(CommandHandler("feed", timed_handler("feed", log_context(self.feed_command))))
+            self.application.add_handler(CommandHandler("feeds", timed_handler("feeds", log_context(self.feeds_command))))
+            self.application.add_handler(CommandHandler("newfeed", timed_handler("newfeed", log_context(self.newfeed_command))))
+            self.application.add_handler(CommandHandler("usefeed", timed_handler("usefeed", log_context(self.usefeed_command))))
+            self.application.add_handler(CommandHandler("feedprofile", timed_handler("feedprofile", log_context(self.feedprofile_command))))
+            self.application.add_handler(CommandHandler("list", timed_handler("list", log_context(self.list_command))))
+            self.application.add_handler(CallbackQueryHandler(
+                timed_handler("list_page", log_context(self.list_page_callback)), pattern=r"^list:"
+            ))
+            self.application.add_handler(CommandHandler("search", timed_handler("search", log_context(self.search_command))))
+            self.application.add_handler(CommandHandler("delete", timed_handler("delete", log_context(self.delete_command))))
+            self.application.add_handler(CommandHandler("setimage", timed_handler("setimage", log_context(self.set_image_command))))
+            self.application.add_handler(CommandHandler("upload", timed_handler("upload", log_context(self.upload_command))))
+            self.application.add_handler(CommandHandler("web", timed_handler("web", log_context(self.web_command))))
+            self.application.add_handler(MessageHandler(filters.PHOTO, timed_handler("image", log_context(self.handle_image))))
+            self.application.add_handler(MessageHandler(
+                filters.AUDIO | filters.VIDEO | filters.Document.AUDIO | filters.Document.VIDEO,
+                timed_handler("file", log_context(self.handle_file))
+            ))
+            self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler("url", log_context(self.handle_url))))
             # Admin commands    
-            self.application.add_handler(CommandHandler("stat", self.stat_command))
+            self.application.add_handler(CommandHandler("stat", timed_handler("stat", log_context(self.stat_command))))
             logger.info("Message handlers setup completed")
         except Exception as e:
             logger.error(f"Error setting up handlers: {e}", exc_info=True)
@@ -63,6 +113,12 @@ class PodcastBot:
         try:
             await self.application.initialize()
             await self.application.start()
+            # Before polling, so cleanup can't race with new downloads
+            await self.resume_jobs()
+            if self.integrity_interval:
+                task = asyncio.create_task(self.integrity.run(self.integrity_interval))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
             await self.application.updater.start_polling()
             logger.info("Bot polling started successfully")
             if self.admin_id:
@@ -93,13 +149,100 @@ class PodcastBot:
             logger.error(f"Error stopping bot: {e}", exc_info=True)
             raise
 
-    async def _process_and_save_image(self, session: Session, image_bytes: bytes, user: User, username: str) -> bool:
+    async def _notify_rate_limited(self, update: Update, key: str, wait: float):
+        user_id = update.effective_user.id
+        if self._rate_limit_notified.get(user_id) or not update.effective_message:
+            return
+        self._rate_limit_notified.set(user_id, True)
+        await update.effective_message.reply_text(get_text(get_lang(update), key, seconds=math.ceil(wait)))
+
+    async def check_rate_limit(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Drop updates of users sending more than RATE_LIMIT_BOT allows"""
+        if not update.effective_user or update.effective_user.id == self.admin_id:
+            return
+        wait = await bot_limiter.hit(update.effective_user.id)
+        if wait:
+            logger.info(f"Rate limited user {update.effective_user.id}", extra={'retry_after': round(wait, 1)})
+            if update.callback_query:
+                await update.callback_query.answer()
+            await self._notify_rate_limited(update, 'rate_limited', wait)
+            raise ApplicationHandlerStop
+
+    async def _allow_ingest(self, update: Update) -> bool:
+        """Take a RATE_LIMIT_INGEST token for a download or upload, telling the user if there is none"""
+        if update.effective_user.id == self.admin_id:
+            return True
+        wait = await ingest_limiter.hit(update.effective_user.id)
+        if wait:
+            await self._notify_rate_limited(update, 'ingest_rate_limited', wait)
+        return not wait
+
+    def _get_user(self, update: Update) -> Optional[UserIdentity]:
+        """Get identity of the registered user behind the update, None if not registered
+
+        Served from the shared user cache, so most handlers don't hit the
+        database just to check registration. Also keeps the stored language
+        in sync so the feed is localized like the bot.
+        """
+        identity = user_cache.get_by_telegram_id(self.session_factory, update.effective_user.id)
+        lang = get_lang(update)
+        if identity and identity.language != lang:
+            session = self.session_factory()
+            try:
+                session.query(User).filter_by(id=identity.id).update({'language': lang})
+                session.commit()
+                # Feeds are rendered in the user's language
+                for (feed_uuid,) in session.query(Feed.uuid).filter_by(user_id=identity.id):
+                    feed_cache.invalidate(feed_uuid)
+            finally:
+                session.close()
+            user_cache.invalidate(identity.telegram_id, identity.uuid)
+            identity = identity._replace(language=lang)
+        return identity
+
+    def _current_feed(self, session: Session, user: UserIdentity) -> Feed:
+        """Feed that new videos and the feed commands apply to"""
+        feed = session.get(Feed, user.current_feed_id) if user.current_feed_id else None
+        if feed is None or feed.user_id != user.id:
+            feed = session.query(Feed).filter_by(uuid=user.uuid).one()
+        return feed
+
+    def _feed_title(self, feed: Feed, lang: str) -> str:
+        return escape_markdown(feed.title) if feed.title else get_text(lang, 'feed_default_title')
+
+    def _feeds_text(self, session: Session, user: UserIdentity, lang: str) -> str:
+        current = self._current_feed(session, user)
+        track_counts = dict(
+            session.query(feed_tracks.c.feed_id, func.count())
+            .join(Feed, Feed.id == feed_tracks.c.feed_id)
+            .filter(Feed.user_id == user.id)
+            .group_by(feed_tracks.c.feed_id)
+        )
+        domain = os.getenv("DOMAIN")
+        feeds_text = []
+        for i, feed in enumerate(session.query(Feed).filter_by(user_id=user.id).order_by(Feed.id), 1):
+            feeds_text.append(get_text(lang, 'feeds_item',
+                marker='▶️' if feed.id == current.id else '▫️',
+                number=i,
+                title=self._feed_title(feed, lang),
+                track_count=track_counts.get(feed.id, 0),
+                profile=feed.profile,
+                rss_url=f"https://{domain}/rss/{feed.uuid}"
+            ))
+        return '\n\n'.join(feeds_text)
+
+    def _set_current_feed(self, session: Session, user: UserIdentity, feed: Feed):
+        session.query(User).filter_by(id=user.id).update({'current_feed_id': feed.id})
+        session.commit()
+        user_cache.invalidate(user.telegram_id, user.uuid)
+
+    async def _process_and_save_image(self, session: Session, image_bytes: bytes, feed: Feed, username: str) -> bool:
         """Process and save podcast cover image
 
         Args:
             session: Active database session
             image_bytes: Raw image bytes
-            user: User object
+            feed: Feed to set the cover of
             username: Username to display on the cover
 
         Returns:
@@ -110,12 +253,13 @@ class PodcastBot:
             processed_image = await asyncio.to_thread(process_podcast_cover, image_bytes, f'@{username}')
 
             # Save the modified image
-            os.makedirs(f"data/{user.uuid}", exist_ok=True)
-            with open(f"data/{user.uuid}/image.jpg", "wb") as f:
+            os.makedirs(f"data/{feed.uuid}", exist_ok=True)
+            with open(f"data/{feed.uuid}/image.jpg", "wb") as f:
                 f.write(processed_image)
 
-            user.image = True
+            feed.image = True
             session.commit()
+            feed_cache.invalidate(feed.uuid)
             return True
         except Exception as e:
             logger.error(f"Error processing image: {e}", exc_info=True)
@@ -125,17 +269,30 @@ class PodcastBot:
         """Handle /start command"""
         session = self.session_factory()
         try:
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
+            identity = self._get_user(update)
             is_new_user = False
 
-            if not user:
+            user = session.get(User, identity.id) if identity else None
+            if identity and user is None:
+                # Stale cache entry, e.g. after a snapshot import replaced the users
+                user_cache.invalidate(identity.telegram_id, identity.uuid)
+                user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
+            if user:
+                feed = session.query(Feed).filter_by(uuid=user.uuid).one()
+            else:
                 user = User(
                     telegram_id=update.effective_user.id,
                     uuid=str(uuid.uuid4()),
-                    username=update.effective_user.username
+                    username=update.effective_user.username,
+                    language=get_lang(update)
                 )
-                session.add(user)
+                # The default feed shares the user's uuid
+                feed = Feed(user=user, uuid=user.uuid, profile=DEFAULT_PROFILE)
+                session.add_all([user, feed])
+                session.flush()
+                user.current_feed_id = feed.id
                 session.commit()
+                user_cache.invalidate(user.telegram_id, user.uuid)
                 is_new_user = True
 
             # Try to get user's profile photo
@@ -147,7 +304,7 @@ class PodcastBot:
                     photo_file = await photo.get_file()
                     image_bytes = await photo_file.download_as_bytearray()
 
-                    await self._process_and_save_image(session, image_bytes, user, update.effective_user.username)
+                    await self._process_and_save_image(session, image_bytes, feed, update.effective_user.username)
             except Exception as e:
                 logger.error(f"Error setting default image from avatar: {e}", exc_info=True)
 
@@ -176,109 +333,309 @@ class PodcastBot:
 
     async def feed_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /feed command"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
+        session = self.session_factory()
+        try:
+            feed = self._current_feed(session, user)
+            domain = os.getenv("DOMAIN")
+            rss_url = f"https://{domain}/rss/{feed.uuid}"
+        finally:
+            session.close()
+
+        await update.message.reply_text(
+            get_text(get_lang(update), 'feed', rss_url=rss_url),
+            parse_mode='Markdown'
+        )
+
+    async def feeds_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /feeds command - list the user's feeds"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
+        session = self.session_factory()
+        try:
+            feeds_text = self._feeds_text(session, user, get_lang(update))
+        finally:
+            session.close()
+
+        await update.message.reply_text(
+            get_text(get_lang(update), 'feeds', feeds=feeds_text),
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+
+    async def newfeed_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /newfeed command - create a feed and make it current"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
+        title = ' '.join(context.args or []).strip()
+        if not title:
+            await update.message.reply_text(get_text(get_lang(update), 'newfeed_usage'), parse_mode='Markdown')
+            return
+
         session = self.session_factory()
         try:
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-            if not user:
-                await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            if session.query(Feed).filter_by(user_id=user.id).count() >= MAX_FEEDS:
+                await update.message.reply_text(get_text(get_lang(update), 'newfeed_limit', limit=MAX_FEEDS))
                 return
 
+            feed = Feed(user_id=user.id, title=title[:200], profile=DEFAULT_PROFILE)
+            session.add(feed)
+            session.flush()
+            self._set_current_feed(session, user, feed)
+
             domain = os.getenv("DOMAIN")
-            rss_url = f"https://{domain}/rss/{user.uuid}"
+            await update.message.reply_text(
+                get_text(get_lang(update), 'newfeed_success',
+                    title=self._feed_title(feed, get_lang(update)),
+                    rss_url=f"https://{domain}/rss/{feed.uuid}"
+                ),
+                parse_mode='Markdown'
+            )
+        finally:
+            session.close()
+
+    async def usefeed_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /usefeed command - choose the feed new videos go to"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
 
+        session = self.session_factory()
+        try:
+            feeds = session.query(Feed).filter_by(user_id=user.id).order_by(Feed.id).all()
+            try:
+                feed_num = int(context.args[0])
+            except (IndexError, ValueError):
+                feed_num = 0
+            if not 1 <= feed_num <= len(feeds):
+                await update.message.reply_text(
+                    get_text(get_lang(update), 'usefeed_invalid', feeds=self._feeds_text(session, user, get_lang(update))),
+                    parse_mode='Markdown',
+                    disable_web_page_preview=True
+                )
+                return
+
+            feed = feeds[feed_num - 1]
+            self._set_current_feed(session, user, feed)
             await update.message.reply_text(
-                get_text(get_lang(update), 'feed', rss_url=rss_url),
+                get_text(get_lang(update), 'usefeed_success', title=self._feed_title(feed, get_lang(update))),
                 parse_mode='Markdown'
             )
         finally:
             session.close()
 
-    async def list_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /list command"""
+    async def feedprofile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /feedprofile command - encoding profile for new videos of the current feed"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
         session = self.session_factory()
         try:
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-            if not user:
-                await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            feed = self._current_feed(session, user)
+            profile = context.args[0].lower() if context.args else None
+            if profile not in PROFILES:
+                profiles = ', '.join(f"`{name}` ({settings['quality']} kbps)" for name, settings in PROFILES.items())
+                await update.message.reply_text(
+                    get_text(get_lang(update), 'feedprofile_usage', profile=feed.profile, profiles=profiles),
+                    parse_mode='Markdown'
+                )
                 return
 
-            tracks = session.query(Track).filter_by(user_id=user.id).order_by(Track.created_at.desc()).all()
-            if not tracks:
+            # Applies to new downloads; episodes already in the feed keep their encoding
+            feed.profile = profile
+            session.commit()
+            await update.message.reply_text(
+                get_text(get_lang(update), 'feedprofile_success',
+                    title=self._feed_title(feed, get_lang(update)),
+                    profile=profile
+                ),
+                parse_mode='Markdown'
+            )
+        finally:
+            session.close()
+
+    def _track_item(self, track: Track, number: int, lang: str) -> str:
+        if not track.youtube_url:
+            item_key = 'track_item_upload'
+        elif is_youtube_url(track.youtube_url):
+            item_key = 'track_item'
+        else:
+            item_key = 'track_item_link'
+        return get_text(lang, item_key, number=number, title=track.title, url=track.youtube_url)
+
+    def _list_page(self, session: Session, feed: Feed, lang: str, page: int) -> tuple:
+        """Text and navigation keyboard of one /list page, None text if the feed is empty
+
+        Numbers continue across pages, so they are the ones /delete takes.
+        """
+        total = feed_tracks_query(session, feed.id).count()
+        if not total:
+            return None, None
+        pages = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+        page = min(max(page, 0), pages - 1)
+        tracks = feed_tracks_query(session, feed.id).offset(page * LIST_PAGE_SIZE).limit(LIST_PAGE_SIZE).all()
+
+        tracks_text = [
+            self._track_item(track, i, lang)
+            for i, track in enumerate(tracks, page * LIST_PAGE_SIZE + 1)
+        ]
+        if pages == 1:
+            return get_text(lang, 'list', tracks='\n'.join(tracks_text)), None
+
+        tracks_text.append('')
+        tracks_text.append(get_text(lang, 'list_page', page=page + 1, pages=pages))
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton(get_text(lang, 'list_prev'), callback_data=f"list:{feed.id}:{page - 1}"))
+        if page < pages - 1:
+            buttons.append(InlineKeyboardButton(get_text(lang, 'list_next'), callback_data=f"list:{feed.id}:{page + 1}"))
+        return get_text(lang, 'list', tracks='\n'.join(tracks_text)), InlineKeyboardMarkup([buttons])
+
+    async def list_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /list command"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
+        session = self.session_factory()
+        try:
+            text, keyboard = self._list_page(session, self._current_feed(session, user), get_lang(update), 0)
+            if text is None:
                 await update.message.reply_text(
                     get_text(get_lang(update), 'list_empty'),
                     parse_mode='Markdown'
                 )
                 return
 
-            tracks_text = []
-            for i, track in enumerate(tracks, 1):
-                tracks_text.append(get_text(get_lang(update), 'track_item',
-                    number=i,
-                    title=track.title,
-                    url=track.youtube_url
-                ))
-
             await update.message.reply_text(
-                get_text(get_lang(update), 'list', tracks='\n'.join(tracks_text)),
+                text,
                 parse_mode='Markdown',
-                disable_web_page_preview=True
+                disable_web_page_preview=True,
+                reply_markup=keyboard
             )
         finally:
             session.close()
 
-    async def delete_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /delete command"""
+    async def list_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the page buttons under a /list message"""
+        query = update.callback_query
+        await query.answer()
+        user = self._get_user(update)
+        if not user:
+            return
+
+        _, feed_id, page = query.data.split(':')
         session = self.session_factory()
         try:
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-            if not user:
-                await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            feed = session.get(Feed, int(feed_id))
+            if feed is None or feed.user_id != user.id:
                 return
+            text, keyboard = self._list_page(session, feed, get_lang(update), int(page))
+            if text is None:
+                text = get_text(get_lang(update), 'list_empty')
+            await query.edit_message_text(
+                text,
+                parse_mode='Markdown',
+                disable_web_page_preview=True,
+                reply_markup=keyboard
+            )
+        finally:
+            session.close()
+
+    async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /search command - episodes of all feeds matching the words"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
 
-            tracks = session.query(Track).filter_by(user_id=user.id).order_by(Track.created_at.desc()).all()
-            if not tracks:
+        query = ' '.join(context.args or [])
+        if not search_terms(query):
+            await update.message.reply_text(get_text(get_lang(update), 'search_usage'), parse_mode='Markdown')
+            return
+
+        session = self.session_factory()
+        try:
+            tracks = user_tracks_query(session, user.id, query)
+            found = tracks.limit(LIST_PAGE_SIZE + 1).all()
+            if not found:
                 await update.message.reply_text(
-                    get_text(get_lang(update), 'list_empty'),
+                    get_text(get_lang(update), 'search_empty', query=escape_markdown(query)),
                     parse_mode='Markdown'
                 )
                 return
 
-            try:
-                track_num = int(context.args[0])
-            except (IndexError, ValueError):
-                tracks_text = []
-                for i, track in enumerate(tracks, 1):
-                    tracks_text.append(f"{i}. {track.title}")
+            tracks_text = [self._track_item(track, i, get_lang(update)) for i, track in enumerate(found[:LIST_PAGE_SIZE], 1)]
+            if len(found) > LIST_PAGE_SIZE:
+                # Counting is only worth it when there is more than a page
+                more = tracks.order_by(None).count() - LIST_PAGE_SIZE
+                tracks_text.append(get_text(get_lang(update), 'search_more', count=more))
+            await update.message.reply_text(
+                get_text(get_lang(update), 'search_results', query=escape_markdown(query), tracks='\n'.join(tracks_text)),
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+        finally:
+            session.close()
 
+    async def delete_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /delete command"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
+        session = self.session_factory()
+        try:
+            feed = self._current_feed(session, user)
+            tracks = feed_tracks_query(session, feed.id)
+            total = tracks.count()
+            if not total:
                 await update.message.reply_text(
-                    get_text(get_lang(update), 'delete_invalid', tracks='\n'.join(tracks_text)),
+                    get_text(get_lang(update), 'list_empty'),
                     parse_mode='Markdown'
                 )
                 return
 
-            if not 1 <= track_num <= len(tracks):
+            try:
+                track_num = int(context.args[0])
+            except (IndexError, ValueError):
+                track_num = None
+            if track_num is None or not 1 <= track_num <= total:
+                # Only the first page, the whole library may not fit into a message
                 tracks_text = []
-                for i, track in enumerate(tracks, 1):
+                for i, track in enumerate(tracks.limit(LIST_PAGE_SIZE), 1):
                     tracks_text.append(f"{i}. {track.title}")
+                if total > LIST_PAGE_SIZE:
+                    tracks_text.append(get_text(get_lang(update), 'list_more', count=total - LIST_PAGE_SIZE))
 
                 await update.message.reply_text(
-                    get_text(get_lang(update), 'delete_invalid_number', tracks='\n'.join(tracks_text)),
+                    get_text(get_lang(update), 'delete_invalid' if track_num is None else 'delete_invalid_number',
+                        tracks='\n'.join(tracks_text)),
                     parse_mode='Markdown'
                 )
                 return
 
-            track = tracks[track_num - 1]
-            file_path = f"data/{user.uuid}/{track.file_name}"
-            try:
-                os.remove(file_path)
-            except OSError:
-                pass  # File might not exist
-
-            session.delete(track)
-            session.commit()
+            track = tracks.offset(track_num - 1).first()
+            title = track.title
+            remove_tracks(session, user.uuid, feed, [track])
 
             await update.message.reply_text(
-                get_text(get_lang(update), 'delete_success', title=track.title),
+                get_text(get_lang(update), 'delete_success', title=title),
                 parse_mode='Markdown'
             )
         finally:
@@ -286,92 +643,296 @@ class PodcastBot:
 
     async def set_image_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /setimage command"""
-        session = self.session_factory()
-        try:
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-            if not user:
-                await update.message.reply_text(get_text(get_lang(update), 'start_first'))
-                return
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
 
-            context.user_data['waiting_for_image'] = True
-            await update.message.reply_text(
-                get_text(get_lang(update), 'setimage_prompt'),
-                parse_mode='Markdown'
-            )
-        finally:
-            session.close()
+        context.user_data['waiting_for_image'] = True
+        await update.message.reply_text(
+            get_text(get_lang(update), 'setimage_prompt'),
+            parse_mode='Markdown'
+        )
+
+    async def _download(self, url: str, profile: str, out_dir: str, progress: DownloadProgress, extractor: str) -> dict:
+        hooks = {
+            'progress_hooks': [progress.progress_hook],
+            'postprocessor_hooks': [progress.postprocessor_hook],
+        }
+        async with self.limits.slot(extractor):
+            # Run the blocking download in a worker thread so it doesn't
+            # stall the event loop (bot polling and the FastAPI server).
+            return await asyncio.to_thread(download_audio, url, profile, out_dir, hooks)
+
+    async def handle_url(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        url = find_url(update.message.text)
+        if not url:
+            return
 
-    def _download_audio(self, ydl_opts: dict, url: str) -> dict:
-        """Blocking yt-dlp download, meant to be run in a worker thread"""
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            return ydl.extract_info(url, download=True)
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
 
-    async def handle_youtube_url(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not update.message.text or not update.message.text.startswith(("https://www.youtube.com/", "https://youtu.be/")):
+        # Matching against yt-dlp's extractors is CPU-bound
+        source = await asyncio.to_thread(classify_url, url)
+        if source is None or not is_allowed(source):
+            sites = ', '.join(sorted(ALLOWED_EXTRACTORS)) if ALLOWED_EXTRACTORS is not None else None
+            await update.message.reply_text(
+                get_text(get_lang(update), 'unsupported_url', sites=sites or get_text(get_lang(update), 'any_site'))
+            )
+            return
+        if not await self._allow_ingest(update):
             return
 
         session = self.session_factory()
         try:
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-            if not user:
-                await update.message.reply_text(get_text(get_lang(update), 'start_first'))
-                return
+            feed = self._current_feed(session, user)
+            # Persist the request first so it survives a restart mid-download
+            job = DownloadJob(
+                user_id=user.id,
+                chat_id=update.effective_chat.id,
+                url=source.url,
+                video_key=source.key,
+                extractor=source.extractor,
+                profile=feed.profile,
+                language=get_lang(update),
+                feed_id=feed.id
+            )
+            session.add(job)
+            session.commit()
 
-            await update.message.reply_text(get_text(get_lang(update), 'download_start'))
+            await self._ingest(session, job)
+        finally:
+            session.close()
 
-            # Create user directory if it doesn't exist
-            user_dir = f"data/{user.uuid}"
-            os.makedirs(user_dir, exist_ok=True)
+    async def _ingest(self, session: Session, job: DownloadJob):
+        """Download the job's video and publish it as a Track of the job's user
 
-            # Download audio
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'outtmpl': f'{user_dir}/%(id)s.%(ext)s',
-            }
+        The job row is deleted together with the Track insert; if the process
+        dies before that, resume_jobs picks the job up on the next start.
+        """
+        bot = self.application.bot
+        lang = job.language or 'en'
+        url, profile, chat_id = job.url, job.profile, job.chat_id
+        user_id, user_uuid = job.user_id, job.user.uuid
+        extractor = job.extractor or 'youtube'
+        file_name = track_file_name(job.video_key, profile)
+        job_key = (job.video_key, profile)
+        out_dir = staging_dir(job.video_key, profile)
+
+        feed = session.get(Feed, job.feed_id) if job.feed_id else None
+        if feed is None:
+            # Jobs from before multiple feeds go to the default feed
+            feed = session.query(Feed).filter_by(uuid=user_uuid).one()
+        feed_id, feed_uuid = feed.id, feed.uuid
+
+        # The user already has this video (maybe in another feed) - list it here as well
+        title = link_existing_track(session, user_id, feed_id, file_name)
+        if title is not None:
+            session.delete(job)
+            session.commit()
+            feed_cache.invalidate(feed_uuid)
+            INGESTS.labels('duplicate').inc()
+            await bot.send_message(chat_id, get_text(lang, 'download_success', title=title))
+            return
+
+        # Don't keep a pooled connection checked out for the whole download
+        session.commit()
+
+        progress = self._downloads.get(job_key)
+        owner = progress is None
+        if owner:
+            status = await bot.send_message(chat_id, get_text(lang, 'download_start'))
+            progress = DownloadProgress(status, lang)
+            self._downloads[job_key] = progress
+            progress.start()
+        else:
+            # Same video is already downloading (for this or another user) - follow that job
+            status = await bot.send_message(chat_id, get_text(lang, 'download_in_progress'))
+            progress.add_message(status, lang)
+
+        INGEST_WAITERS.inc()
+        try:
+            async with self.flights.join(
+                job_key,
+                lambda: self._download(url, profile, out_dir, progress, extractor),
+                release=lambda: remove_staging(out_dir),
+            ) as info:
+                if owner:
+                    del self._downloads[job_key]
+                    await progress.finish()
 
-            try:
-                # Run the blocking download in a worker thread so it doesn't
-                # stall the event loop (bot polling and the FastAPI server).
-                info = await asyncio.to_thread(self._download_audio, ydl_opts, update.message.text)
                 title = info['title']
-                video_id = info['id']
-                file_name = f"{video_id}.mp3"
-                file_path = f"{user_dir}/{file_name}"
+                staged_path = f"{out_dir}/{info['id']}.mp3"
 
                 # Check if the original file exists
-                if not os.path.exists(file_path):
-                    logger.error(f"Original file not found: {file_path}")
-                    await update.message.reply_text(get_text(get_lang(update), 'download_error', error="Downloaded file not found"))
+                if not os.path.exists(staged_path):
+                    raise FileNotFoundError("Downloaded file not found")
+
+                # Same user sent the same video twice - keep a single track
+                if link_existing_track(session, user_id, feed_id, file_name) is not None:
+                    session.delete(job)
+                    session.commit()
+                    feed_cache.invalidate(feed_uuid)
+                    INGESTS.labels('duplicate').inc()
+                    await bot.send_message(chat_id, get_text(lang, 'download_success', title=title))
                     return
 
-                # Process the audio file
-                audio = mutagen.File(file_path)
-                duration = str(int(audio.info.length))
-                channel_name = info.get('channel') or info.get('uploader')
-                description = info.get('description')
-
-                # Save to database
-                track = Track(
-                    user_id=user.id,
+                store_track(
+                    session, staged_path, user_uuid, feed_id, job=job,
+                    user_id=user_id,
                     title=title,
-                    youtube_url=update.message.text,
-                    file_name=f"{video_id}.mp3",
-                    duration=duration,
-                    channel_name=channel_name,
-                    description=description
+                    youtube_url=url,
+                    file_name=file_name,
+                    channel_name=info.get('channel') or info.get('uploader'),
+                    description=info.get('description'),
+                    chapters=json.dumps(info['episode_chapters'], ensure_ascii=False) if info.get('episode_chapters') else None,
+                    **audio_metadata(info, staged_path, profile)
                 )
-                session.add(track)
+
+            INGESTS.labels('success').inc()
+            await bot.send_message(chat_id, get_text(lang, 'download_success', title=title))
+        except Exception as e:
+            logger.error(f"Error processing video: {e}", exc_info=True)
+            INGESTS.labels('error').inc()
+            try:
+                session.rollback()
+                session.delete(job)
                 session.commit()
+            except Exception as db_error:
+                logger.error(f"Error removing failed download job: {db_error}", exc_info=True)
+            await bot.send_message(chat_id, get_text(lang, 'download_error', error=str(e)))
+        finally:
+            INGEST_WAITERS.dec()
+            if owner and self._downloads.get(job_key) is progress:
+                del self._downloads[job_key]
+                await progress.finish()
+
+    def _upload_url(self, feed: Feed) -> str:
+        domain = os.getenv("DOMAIN")
+        return f"https://{domain}/upload/{upload_token(feed.uuid)}"
+
+    async def upload_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /upload command - link for uploading files through the browser"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
 
-                await update.message.reply_text(get_text(get_lang(update), 'download_success', title=title))
-            except Exception as e:
-                logger.error(f"Error processing video: {e}", exc_info=True)
-                await update.message.reply_text(get_text(get_lang(update), 'download_error', error=str(e)))
+        session = self.session_factory()
+        try:
+            feed = self._current_feed(session, user)
+            await update.message.reply_text(
+                get_text(get_lang(update), 'upload_link',
+                    title=self._feed_title(feed, get_lang(update)),
+                    upload_url=self._upload_url(feed)
+                ),
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+        finally:
+            session.close()
+
+    async def web_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /web command - link to the web UI for managing episodes"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
+        domain = os.getenv("DOMAIN")
+        await update.message.reply_text(
+            get_text(get_lang(update), 'web_link', web_url=f"https://{domain}/library#{library_token(user.uuid)}"),
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
+
+    async def handle_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle audio or video sent as a file - add it to the current feed"""
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
+        if not await self._allow_ingest(update):
+            return
+
+        message = update.message
+        media = message.audio or message.video or message.document
+        lang = get_lang(update)
+
+        session = self.session_factory()
+        try:
+            feed = self._current_feed(session, user)
+            feed_id, profile = feed.id, feed.profile
+            if media.file_size and media.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+                await message.reply_text(
+                    get_text(lang, 'upload_too_large', upload_url=self._upload_url(feed)),
+                    parse_mode='Markdown',
+                    disable_web_page_preview=True
+                )
+                return
+        finally:
+            session.close()
+
+        file_name = getattr(media, 'file_name', None)
+        title = (
+            getattr(media, 'title', None)
+            or message.caption
+            or (os.path.splitext(file_name)[0] if file_name else None)
+            or get_text(lang, 'upload_default_title', date=message.date.strftime('%Y-%m-%d %H:%M'))
+        )
+        # Not a DownloadJob: after a restart the janitor removes this staging dir
+        out_dir = staging_dir(f"upload-{uuid.uuid4().hex}", profile)
+        status = await message.reply_text(get_text(lang, 'upload_processing'))
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+            src_path = f"{out_dir}/upload"
+            tg_file = await media.get_file()
+            await tg_file.download_to_drive(src_path)
+            title, _ = await asyncio.to_thread(
+                process_upload, self.session_factory, feed_id, src_path, title,
+                channel_name=getattr(media, 'performer', None)
+            )
+            await message.reply_text(get_text(lang, 'download_success', title=title))
+        except UploadError as e:
+            await message.reply_text(get_text(lang, 'upload_error', error=str(e)))
+        except Exception as e:
+            logger.error(f"Error processing uploaded file: {e}", exc_info=True)
+            await message.reply_text(get_text(lang, 'upload_error', error=str(e)))
+        finally:
+            await asyncio.to_thread(remove_staging, out_dir)
+            try:
+                await status.delete()
+            except Exception:
+                pass
+
+    async def resume_jobs(self):
+        """Clean up after an unclean shutdown and resume interrupted downloads"""
+        stats = await asyncio.to_thread(reconcile_storage, self.session_factory)
+        logger.info(f"Storage reconciled: {stats}")
+
+        session = self.session_factory()
+        try:
+            job_ids = [job_id for (job_id,) in session.query(DownloadJob.id)]
+        finally:
+            session.close()
+
+        for job_id in job_ids:
+            logger.info(f"Resuming interrupted download job {job_id}")
+            task = asyncio.create_task(self._resume_job(job_id))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def _resume_job(self, job_id: int):
+        session = self.session_factory()
+        try:
+            job = session.get(DownloadJob, job_id)
+            if job:
+                await self._ingest(session, job)
+        except Exception as e:
+            logger.error(f"Error resuming download job {job_id}: {e}", exc_info=True)
         finally:
             session.close()
 
@@ -380,13 +941,13 @@ class PodcastBot:
         if not context.user_data.get('waiting_for_image'):
             return
 
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
+
         session = self.session_factory()
         try:
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-            if not user:
-                await update.message.reply_text(get_text(get_lang(update), 'start_first'))
-                return
-
             try:
                 # Get the photo file
                 photo = await update.message.photo[-1].get_file()
@@ -395,7 +956,9 @@ class PodcastBot:
                 image_bytes = await photo.download_as_bytearray()
 
                 # Process and save the image
-                success = await self._process_and_save_image(session, image_bytes, user, update.effective_user.username)
+                success = await self._process_and_save_image(
+                    session, image_bytes, self._current_feed(session, user), update.effective_user.username
+                )
 
                 if success:
                     await update.message.reply_text(
@@ -419,20 +982,16 @@ class PodcastBot:
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
         logger.info(f"Help command called by {update.effective_user}")
-        session = self.session_factory()
-        try:
-            user = session.query(User).filter_by(telegram_id=update.effective_user.id).first()
-            if not user:
-                await update.message.reply_text(get_text(get_lang(update), 'start_first'))
-                return
+        user = self._get_user(update)
+        if not user:
+            await update.message.reply_text(get_text(get_lang(update), 'start_first'))
+            return
 
-            await update.message.reply_text(
-                get_text(get_lang(update), 'help'),
-                parse_mode='Markdown',
-                disable_web_page_preview=True
-            )
-        finally:
-            session.close()
+        await update.message.reply_text(
+            get_text(get_lang(update), 'help'),
+            parse_mode='Markdown',
+            disable_web_page_preview=True
+        )
 
     async def stat_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /stat command - show statistics for admin"""
@@ -467,6 +1026,23 @@ class PodcastBot:
                 await update.message.reply_text(get_text(get_lang(update), 'no_users'))
                 return
 
+            broken_count = session.query(Track).filter(Track.broken_at.isnot(None)).count()
+            report = self.integrity.report
+            if report:
+                stats.append(get_text(get_lang(update), 'stats_integrity',
+                    finished_at=report['finished_at'].strftime('%Y-%m-%d %H:%M UTC'),
+                    checked=report.get('checked', 0),
+                    missing=report.get('missing', 0),
+                    damaged=report.get('corrupt', 0),
+                    orphaned=report.get('orphaned', 0),
+                    orphaned_size=format_size(report.get('orphaned_bytes', 0)),
+                    quarantined=report.get('quarantined', 0),
+                    repaired=report.get('repaired', 0),
+                    broken=broken_count
+                ))
+            elif self.integrity_interval:
+                stats.append(get_text(get_lang(update), 'stats_integrity_pending', broken=broken_count))
+
             await update.message.reply_text(
                 get_text(get_lang(update), 'stats', stats='\n'.join(stats)),
                 parse_mode='Markdown'
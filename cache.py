@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from models import User
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class UserIdentity(NamedTuple):
+    """The user fields hot paths need, cheap to keep in memory"""
+    id: int
+    uuid: str
+    telegram_id: int
+    language: Optional[str]
+    current_feed_id: Optional[int]
+
+
+class UserCache:
+    """Maps telegram_id and uuid to the user's identity without a DB round trip
+
+    Shared by the bot and the server (they run in one process). Lookups of
+    users that don't exist are remembered separately, for a shorter time, so
+    scans of random uuids neither reach the database nor evict real users;
+    call `invalidate` whenever a user is created or one of the cached fields
+    changes.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600.0, missing_ttl: float = 60.0):
+        self.by_telegram_id = TTLCache(maxsize, ttl)
+        self.by_uuid = TTLCache(maxsize, ttl)
+        self.missing_by_telegram_id = TTLCache(maxsize, missing_ttl)
+        self.missing_by_uuid = TTLCache(maxsize, missing_ttl)
+
+    def get_by_telegram_id(self, session_factory, telegram_id: int) -> Optional[UserIdentity]:
+        identity = self.by_telegram_id.get(telegram_id)
+        if identity is None and not self.missing_by_telegram_id.get(telegram_id):
+            identity = self._load(session_factory, telegram_id=telegram_id)
+            if identity is None:
+                self.missing_by_telegram_id.set(telegram_id, True)
+        return identity
+
+    def get_by_uuid(self, session_factory, user_uuid: str) -> Optional[UserIdentity]:
+        identity = self.by_uuid.get(user_uuid)
+        if identity is None and not self.missing_by_uuid.get(user_uuid):
+            identity = self._load(session_factory, uuid=user_uuid)
+            if identity is None:
+                self.missing_by_uuid.set(user_uuid, True)
+        return identity
+
+    def _load(self, session_factory, **criteria) -> Optional[UserIdentity]:
+        """Query the user; `session_factory` may also be an open Session"""
+        session = session_factory if isinstance(session_factory, Session) else session_factory()
+        try:
+            row = (
+                session.query(User.id, User.uuid, User.telegram_id, User.language, User.current_feed_id)
+                .filter_by(**criteria)
+                .first()
+            )
+        finally:
+            if session is not session_factory:
+                session.close()
+        if row is None:
+            return None
+        identity = UserIdentity(*row)
+        self.by_telegram_id.set(identity.telegram_id, identity)
+        self.by_uuid.set(identity.uuid, identity)
+        return identity
+
+    def invalidate(self, telegram_id: Optional[int] = None, user_uuid: Optional[str] = None):
+        if telegram_id is not None:
+            self.by_telegram_id.invalidate(telegram_id)
+            self.missing_by_telegram_id.invalidate(telegram_id)
+        if user_uuid is not None:
+            self.by_uuid.invalidate(user_uuid)
+            self.missing_by_uuid.invalidate(user_uuid)
+
+
+user_cache = UserCache()
+
+# Rendered RSS documents by feed uuid. Invalidated by the bot whenever a feed
+# or its episode list changes; the TTL bounds how stale a feed can get after
+# changes made elsewhere (backfill, manual SQL) or a hot-reloaded locale.
+feed_cache = TTLCache(maxsize=1000, ttl=300.0)
+
+# Feed uuids and (user uuid, file name) pairs that were looked up and don't
+# exist, so unknown feeds and deleted episodes requested over and over don't
+# cost a query each. New feeds get random uuids, so only new tracks have to
+# invalidate their entry.
+missing_feeds = TTLCache(maxsize=10000, ttl=300.0)
+missing_files = TTLCache(maxsize=10000, ttl=60.0)
@@ -0,0 +1,196 @@
+"""Chapter markers and trimming of downloaded audio.
+
+Sponsor segments (from SponsorBlock) and long silences are removed in the
+same ffmpeg pass that encodes the MP3, so trimming costs no extra decode.
+Chapter times from yt-dlp are shifted by what was cut before them.
+"""
+import json
+import logging
+import re
+import subprocess
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Silence is anything below this level; shortened silences keep this much of it
+SILENCE_THRESHOLD = '-50dB'
+SILENCE_KEEP = 0.5
+
+_SILENCE_START_RE = re.compile(r'silence_start: (-?[\d.]+)')
+_SILENCE_END_RE = re.compile(r'silence_end: ([\d.]+)')
+_DURATION_RE = re.compile(r'Duration: (\d+):(\d+):([\d.]+)')
+# Predicted and actual length of a trimmed file may differ by this much
+# (encoder padding) before the silence log is distrusted
+LENGTH_TOLERANCE = 1.0
+
+
+def merge_intervals(intervals: list) -> list:
+    """Sort (start, end) pairs and merge the overlapping ones"""
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def shift_time(t: float, removed: list) -> float:
+    """Position of `t` once the merged `removed` intervals are cut out"""
+    shift = 0.0
+    for start, end in removed:
+        if start >= t:
+            break
+        shift += min(end, t) - start
+    return t - shift
+
+
+def sponsor_cuts(info: dict, categories: list) -> list:
+    """Segments of the SponsorBlock categories to cut, merged, in seconds of the original audio"""
+    return merge_intervals([
+        (segment['start_time'], segment['end_time'])
+        for segment in info.get('sponsorblock_chapters') or []
+        if segment.get('category') in categories and segment.get('type', 'skip') == 'skip'
+    ])
+
+
+def remap_chapters(chapters: list, stages: list) -> list:
+    """Chapters as [{'startTime', 'title'}] after cutting, stage by stage, the intervals in `stages`
+
+    Chapters that are cut out entirely are dropped.
+    """
+    result = []
+    for chapter in chapters or []:
+        start, end = chapter.get('start_time') or 0.0, chapter.get('end_time')
+        for removed in stages:
+            start = shift_time(start, removed)
+            if end is not None:
+                end = shift_time(end, removed)
+        if end is not None and end - start < 1:
+            continue
+        result.append({'startTime': round(start, 3), 'title': chapter.get('title') or ''})
+    return result
+
+
+def _trim_filter(cuts: list, min_silence: float) -> str:
+    filters = []
+    if cuts:
+        between = '+'.join(f"between(t,{start:.3f},{end:.3f})" for start, end in cuts)
+        filters.append(f"aselect='not({between})',asetpts=N/SR/TB")
+    if min_silence:
+        # silencedetect logs the silences silenceremove shortens, to shift the chapters by
+        filters.append("asplit=2[main][probe];"
+                       f"[probe]silencedetect=noise={SILENCE_THRESHOLD}:d={min_silence},anullsink;"
+                       f"[main]silenceremove=stop_periods=-1:stop_duration={min_silence}:"
+                       f"stop_threshold={SILENCE_THRESHOLD}:stop_silence={SILENCE_KEEP}")
+    return f"[0:a]{','.join(filters)}[out]"
+
+
+def _parse_silences(log: str, min_silence: float) -> list:
+    """Parts of silences removed by silenceremove, from silencedetect's log
+
+    silenceremove only starts cutting once a silence has lasted
+    `min_silence`, then keeps SILENCE_KEEP more of it before the audio resumes.
+    """
+    removed = []
+    start = None
+    for line in log.splitlines():
+        match = _SILENCE_START_RE.search(line)
+        if match:
+            start = max(0.0, float(match.group(1)))
+            continue
+        match = _SILENCE_END_RE.search(line)
+        if match and start is not None:
+            removed.append((start + min_silence + SILENCE_KEEP, float(match.group(1))))
+            start = None
+    # A silence running to the end is removed too, there's nothing after it to shift
+    return merge_intervals(removed)
+
+
+def _input_duration(log: str) -> Optional[float]:
+    match = _DURATION_RE.search(log)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _removed_length(intervals: list, duration: float) -> float:
+    return sum(min(end, duration) - min(start, duration) for start, end in intervals)
+
+
+def encode_trimmed(src: str, dest: str, bitrate: str, cuts: list, min_silence: float,
+                   hook: Optional[Callable[[dict], None]] = None) -> list:
+    """Cut `cuts` and silences longer than `min_silence` seconds while encoding `src` to MP3.
+
+    `hook` gets yt-dlp style postprocessor events, so progress and timing
+    hooks see the encode like yt-dlp's own ExtractAudio step.
+
+    Returns:
+        list: Removed silences in seconds of the audio after `cuts`, None
+        when the encoded length doesn't match them and they can't be trusted
+    """
+    command = ['ffmpeg', '-nostdin', '-hide_banner', '-nostats', '-y', '-i', src, '-vn']
+    if cuts or min_silence:
+        command += ['-filter_complex', _trim_filter(cuts, min_silence), '-map', '[out]']
+    command += ['-codec:a', 'libmp3lame', '-b:a', f"{bitrate}k", dest]
+
+    event = {'postprocessor': 'TrimAudio', 'info_dict': {}}
+    if hook:
+        hook({**event, 'status': 'started'})
+    try:
+        result = subprocess.run(command, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"ffmpeg failed on {src}: {e.stderr.decode('utf-8', 'replace').strip()[-500:]}")
+        raise
+    if hook:
+        hook({**event, 'status': 'finished'})
+    if not min_silence:
+        return []
+
+    log = result.stderr.decode('utf-8', 'replace')
+    silences = _parse_silences(log, min_silence)
+    duration = _input_duration(log)
+    if duration is None:
+        return silences
+    import mutagen
+
+    # silencedetect only predicts what silenceremove cut, check it against the result
+    after_cuts = duration - _removed_length(cuts, duration)
+    expected = after_cuts - _removed_length(silences, after_cuts)
+    actual = mutagen.File(dest).info.length
+    if abs(actual - expected) > LENGTH_TOLERANCE:
+        logger.warning(f"Trimmed {src} to {actual:.1f}s, silences predicted {expected:.1f}s; not remapping chapters")
+        return None
+    return silences
+
+
+def embed_chapters(path: str, chapters: list, duration: float):
+    """Write chapters into the MP3's ID3 tag as CHAP frames with a CTOC table of contents"""
+    from mutagen.id3 import CHAP, CTOC, ID3, TIT2, CTOCFlags, ID3NoHeaderError
+
+    try:
+        tags = ID3(path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    tags.delall('CHAP')
+    tags.delall('CTOC')
+    element_ids = [f"chp{i}" for i in range(len(chapters))]
+    tags.add(CTOC(
+        element_id='toc', flags=CTOCFlags.TOP_LEVEL | CTOCFlags.ORDERED,
+        child_element_ids=element_ids, sub_frames=[TIT2(text=['Chapters'])],
+    ))
+    ends = [chapter['startTime'] for chapter in chapters[1:]] + [duration]
+    for element_id, chapter, end in zip(element_ids, chapters, ends):
+        tags.add(CHAP(
+            element_id=element_id, start_time=int(chapter['startTime'] * 1000), end_time=int(end * 1000),
+            sub_frames=[TIT2(text=[chapter['title']])],
+        ))
+    tags.save(path)
+
+
+def chapters_document(chapters_json: str) -> dict:
+    """Podcasting 2.0 JSON chapters document from a Track.chapters value"""
+    return {'version': '1.2.0', 'chapters': json.loads(chapters_json)}
@@ -0,0 +1,31 @@
+import os
+from typing import Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from metrics import instrument_engine
+from models import init_db
+
+# Bound to the engine on startup (see server.lifespan), so importing this
+# module doesn't connect to the database
+SessionLocal = sessionmaker()
+
+
+def init_database(database_url: Optional[str] = None) -> Engine:
+    """Create the engine and bind SessionLocal to it; later calls reuse it"""
+    engine = SessionLocal.kw.get('bind')
+    if engine is None:
+        engine = init_db(database_url or os.getenv("DATABASE_URL"))
+        instrument_engine(engine)
+        SessionLocal.configure(bind=engine)
+    return engine
+
+
+# Dependency to get database session
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
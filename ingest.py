@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from metrics import DOWNLOAD_SECONDS, TRANSCODE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DOWNLOADS_DIR = "data/.downloads"
+
+# Encoding profiles a track can be produced with, chosen per feed
+PROFILES = {
+    'standard': {'codec': 'mp3', 'quality': '192'},
+    'high': {'codec': 'mp3', 'quality': '320'},
+    # Talks and lectures: a quarter of the size, still clear for voice
+    'speech': {'codec': 'mp3', 'quality': '64'},
+}
+DEFAULT_PROFILE = 'standard'
+
+# Optional trimming of downloads: SponsorBlock categories to cut from YouTube
+# videos (e.g. "sponsor,selfpromo") and the shortest silence, in seconds, to
+# shorten (0 keeps silences). Either one replaces yt-dlp's audio extraction
+# with a single ffmpeg pass that trims and encodes.
+TRIM_CATEGORIES = [name.strip() for name in os.getenv("TRIM_CATEGORIES", "").split(',') if name.strip()]
+TRIM_SILENCE = float(os.getenv("TRIM_SILENCE", "0"))
+
+class _Call:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one in-flight task.
+
+    Every caller awaits the same task and gets its result (or exception).
+    The key is kept until the last caller leaves `join`, at which point the
+    optional `release` callback runs, e.g. to remove shared temporary files.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    @asynccontextmanager
+    async def join(self, key: Hashable, factory: Callable[[], Awaitable[Any]],
+                   release: Optional[Callable[[], None]] = None):
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+        call.waiters += 1
+        try:
+            # shield: a cancelled caller must not cancel the download for the others
+            yield await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and self._calls.get(key) is call:
+                del self._calls[key]
+                if release:
+                    release()
+
+
+def track_file_name(video_id: str, profile: str) -> str:
+    """File name of a video encoded with `profile` in the user's directory
+
+    Default-profile files keep their original `{id}.mp3` name.
+    """
+    if profile == DEFAULT_PROFILE:
+        return f"{video_id}.mp3"
+    return f"{video_id}-{profile}.mp3"
+
+
+def staging_dir(key: str, profile: str) -> str:
+    return f"{DOWNLOADS_DIR}/{key}-{profile}"
+
+
+def preload():
+    """Import the download dependencies ahead of the first request for them"""
+    import mutagen  # noqa: F401
+    import yt_dlp  # noqa: F401
+
+
+def download_audio(url: str, profile: str, out_dir: str, hooks: Optional[dict] = None) -> dict:
+    """Blocking yt-dlp download into `out_dir`, meant to be run in a worker thread
+
+    The result is `{out_dir}/{id}.mp3`. Chapters yt-dlp found are embedded
+    into it and returned as `info['episode_chapters']`, shifted by whatever
+    TRIM_CATEGORIES/TRIM_SILENCE cut out. Trimmed downloads report
+    `duration` None, the length yt-dlp knew no longer applies.
+    """
+    settings = PROFILES[profile]
+    os.makedirs(out_dir, exist_ok=True)
+    trim = bool(TRIM_CATEGORIES or TRIM_SILENCE)
+
+    start = time.perf_counter()
+    download_end = None
+    pp_started = {}
+
+    def timing_hook(d: dict):
+        nonlocal download_end
+        name = d.get('postprocessor')
+        now = time.perf_counter()
+        if d['status'] == 'started':
+            if download_end is None:
+                download_end = now
+            pp_started[name] = now
+        elif d['status'] == 'finished' and name in pp_started:
+            TRANSCODE_SECONDS.labels(name).observe(now - pp_started.pop(name))
+
+    hooks = dict(hooks or {})
+    hooks['postprocessor_hooks'] = [*hooks.get('postprocessor_hooks', []), timing_hook]
+    if trim:
+        # Only fetches the segments into info['sponsorblock_chapters'], cutting happens in encode_trimmed
+        postprocessors = [{'key': 'SponsorBlock', 'categories': TRIM_CATEGORIES, 'when': 'after_filter'}] \
+            if TRIM_CATEGORIES else []
+    else:
+        postprocessors = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': settings['codec'],
+            'preferredquality': settings['quality'],
+        }]
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'postprocessors': postprocessors,
+        'outtmpl': f'{out_dir}/%(id)s.%(ext)s',
+        # Staging dirs are deterministic, so after a restart yt-dlp picks up
+        # the .part file left there instead of starting from scratch
+        'continuedl': True,
+        # For URLs of a video within a playlist, take just the video
+        'noplaylist': True,
+        'noprogress': True,
+        **hooks,
+    }
+    # yt-dlp takes about half a second to import; load it on first use
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+    if trim:
+        # SponsorBlock runs before the download, its hook doesn't mark the end
+        download_end = time.perf_counter()
+    DOWNLOAD_SECONDS.observe((download_end or time.perf_counter()) - start)
+
+    from chapters import embed_chapters, encode_trimmed, remap_chapters, sponsor_cuts
+
+    path = f"{out_dir}/{info['id']}.mp3"
+    stages = []
+    if trim:
+        source = info['requested_downloads'][0]['filepath']
+        cuts = sponsor_cuts(info, TRIM_CATEGORIES)
+        encoded = f"{out_dir}/{info['id']}.trimmed.mp3"
+        silences = encode_trimmed(source, encoded, settings['quality'], cuts, TRIM_SILENCE,
+                                  hook=lambda d: [hook(d) for hook in hooks['postprocessor_hooks']])
+        os.replace(encoded, path)
+        if source != path:
+            os.remove(source)
+        stages = [cuts, silences]
+        info['duration'] = None
+
+    # Chapters would land at the wrong times if the removed silences are unknown
+    info['episode_chapters'] = remap_chapters(info.get('chapters'), stages) if None not in stages else []
+    if info['episode_chapters']:
+        import mutagen
+
+        embed_chapters(path, info['episode_chapters'], mutagen.File(path).info.length)
+    return info
+
+
+def audio_metadata(info: dict, file_path: str, profile: str) -> dict:
+    """Collect duration, bitrate and size of a downloaded track.
+
+    yt-dlp already reports the duration and the bitrate is fixed by the
+    profile's constant-bitrate encode, so the file is only stat'ed. It is
+    opened with mutagen only if yt-dlp didn't know the duration.
+    """
+    duration = info.get('duration')
+    bitrate = int(PROFILES[profile]['quality']) * 1000
+    if duration is None:
+        import mutagen
+
+        audio = mutagen.File(file_path)
+        duration = audio.info.length
+        bitrate = getattr(audio.info, 'bitrate', None) or bitrate
+    return {
+        'duration': int(duration),
+        'bitrate': bitrate,
+        'file_size': os.path.getsize(file_path),
+    }
+
+
+def publish_file(src: str, dest: str):
+    """Atomically put a downloaded file into a user's directory.
+
+    The file is linked (or copied across filesystems) under a temporary
+    name first and renamed into place, so `dest` is either absent or
+    complete. Hard links keep several users sharing one download from
+    duplicating it on disk.
+    """
+    directory, name = os.path.split(dest)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+def remove_staging(path: str):
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,262 @@
+import asyncio
+import ctypes
+import logging
+import os
+import platform
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.orm import sessionmaker
+
+from cache import feed_cache, missing_files
+from ingest import publish_file
+from janitor import last_change
+from metrics import INTEGRITY_LAST_SCAN, INTEGRITY_PROBLEMS
+from models import Feed, Track, User, feed_tracks
+
+logger = logging.getLogger(__name__)
+
+# Damaged and orphaned files are moved here, per user, instead of being deleted
+QUARANTINE_DIR = "data/.quarantine"
+# Unreferenced files changed more recently may belong to a track that is being committed
+ORPHAN_MIN_AGE = 3600
+
+_IOPRIO_SET = {'x86_64': 251, 'aarch64': 30}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+
+
+def _lower_priority():
+    """Give the calling thread the lowest CPU and idle I/O priority (Linux only)"""
+    tid = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except (AttributeError, OSError):
+        pass
+    syscall = _IOPRIO_SET.get(platform.machine())
+    if syscall:
+        try:
+            ctypes.CDLL(None, use_errno=True).syscall(syscall, _IOPRIO_WHO_PROCESS, tid, _IOPRIO_CLASS_IDLE << 13)
+        except (AttributeError, OSError):
+            pass
+
+
+def quarantine(file_path: str, user_uuid: str) -> str:
+    """Move a file of a user out of the served directory; returns its new path"""
+    target = os.path.join(QUARANTINE_DIR, user_uuid, os.path.basename(file_path))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(file_path, target)
+    return target
+
+
+class IntegrityScanner:
+    """Reconciles the tracks table with the data directory in the background.
+
+    Each pass walks the tracks in batches and flags the missing and
+    damaged files, then walks the users' directories for mp3 files no
+    track references and quarantines those.
+    Files are checked by probing their headers, and only again once their
+    size or mtime changes; a playable file whose size differs from the
+    track's `file_size` just gets the track's metadata refreshed. A missing
+    or damaged file is replaced by a hard link to a healthy copy with the
+    same name in another user's directory if there is one; otherwise a
+    damaged file is quarantined, and the track gets `broken_at` and is left
+    out of the feeds until the file is back.
+
+    All file and database work runs on one thread with idle I/O priority,
+    with a pause between batches, so scanning never holds up requests.
+    """
+
+    def __init__(self, session_factory: sessionmaker, batch_size: int = 100, pause: float = 0.5):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.pause = pause
+        self.report: Optional[dict] = None  # counters of the last finished pass
+        self._verified = {}  # file path -> (size, mtime) when its headers last probed fine
+        self._seen = set()  # files of existing tracks seen in the current pass
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='integrity',
+                                            initializer=_lower_priority)
+
+    async def run(self, interval: float):
+        """Scan every `interval` seconds until cancelled"""
+        while True:
+            try:
+                await self.scan()
+            except Exception as e:
+                logger.error(f"Integrity scan failed: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    async def scan(self) -> dict:
+        """One full pass; returns and keeps in `report` what it found"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        stats = defaultdict(int)
+        last_id = 0
+        while last_id is not None:
+            last_id = await loop.run_in_executor(self._executor, self._check_tracks, last_id, stats)
+            await asyncio.sleep(self.pause)
+        last_id = 0
+        while last_id is not None:
+            last_id = await loop.run_in_executor(self._executor, self._check_orphans, last_id, stats)
+            await asyncio.sleep(self.pause)
+
+        # Forget files of deleted tracks
+        self._verified = {path: signature for path, signature in self._verified.items() if path in self._seen}
+        self._seen = set()
+        self.report = {**stats, 'finished_at': datetime.now(timezone.utc), 'seconds': time.monotonic() - started}
+        INTEGRITY_LAST_SCAN.set_to_current_time()
+        logger.info(f"Integrity scan finished: {dict(stats)}")
+        return self.report
+
+    def _check_file(self, file_path: str) -> tuple[Optional[str], Optional[dict]]:
+        """Problem with the file ('missing', 'corrupt' or None if it is fine) and,
+        when its headers were probed, its file_size, duration and bitrate
+        """
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return 'missing', None
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if self._verified.get(file_path) == signature:
+            return None, None
+        self._verified.pop(file_path, None)
+        if not stat.st_size:
+            return 'corrupt', None
+        import mutagen
+
+        try:
+            audio = mutagen.File(file_path)
+        except Exception:
+            audio = None
+        if audio is None or not audio.info.length:
+            return 'corrupt', None
+        self._verified[file_path] = signature
+        return None, {
+            'file_size': stat.st_size,
+            'duration': int(audio.info.length),
+            'bitrate': getattr(audio.info, 'bitrate', None),
+        }
+
+    def _repair(self, session, user_uuid: str, file_name: str) -> bool:
+        """Link a healthy copy of `file_name` from another user's directory, if there is one"""
+        others = (
+            session.query(User.uuid)
+            .join(Track)
+            .filter(Track.file_name == file_name, User.uuid != user_uuid, Track.broken_at.is_(None))
+        )
+        for (other_uuid,) in others:
+            source = f"data/{other_uuid}/{file_name}"
+            if self._check_file(source)[0] is None:
+                publish_file(source, f"data/{user_uuid}/{file_name}")
+                logger.info(f"Restored data/{user_uuid}/{file_name} from {source}")
+                return True
+        return False
+
+    def _check_tracks(self, last_id: int, stats: dict) -> Optional[int]:
+        """Check the files of a batch of tracks after `last_id`; returns the last id or None when done"""
+        session = self.session_factory()
+        try:
+            rows = (
+                session.query(Track.id, Track.file_name, Track.file_size, Track.broken_at, User.uuid)
+                .join(User)
+                .filter(Track.id > last_id)
+                .order_by(Track.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not rows:
+                return None
+
+            broken, fixed, refreshed = [], [], {}
+            for row in rows:
+                stats['checked'] += 1
+                file_path = f"data/{row.uuid}/{row.file_name}"
+                self._seen.add(file_path)
+                problem, metadata = self._check_file(file_path)
+                if problem:
+                    stats[problem] += 1
+                    if row.broken_at is None:
+                        INTEGRITY_PROBLEMS.labels(problem).inc()
+                    if self._repair(session, row.uuid, row.file_name):
+                        stats['repaired'] += 1
+                        problem, metadata = self._check_file(file_path)
+                    elif problem == 'corrupt':
+                        logger.warning(f"Quarantined damaged file {quarantine(file_path, row.uuid)}")
+                        stats['quarantined'] += 1
+                if metadata and metadata['file_size'] != row.file_size:
+                    # A playable file whose row is stale, e.g. from before it was re-encoded
+                    refreshed[row.id] = metadata
+                if problem and row.broken_at is None:
+                    logger.warning(f"Track {row.id} has no usable file {file_path}")
+                    broken.append(row.id)
+                elif not problem and row.broken_at is not None:
+                    fixed.append(row.id)
+
+            changed = broken + fixed + list(refreshed)
+            if changed:
+                now = datetime.now(timezone.utc)
+                if broken:
+                    session.query(Track).filter(Track.id.in_(broken)).update({'broken_at': now})
+                if fixed:
+                    session.query(Track).filter(Track.id.in_(fixed)).update({'broken_at': None})
+                for track_id, metadata in refreshed.items():
+                    session.query(Track).filter_by(id=track_id).update(metadata)
+                    stats['refreshed'] += 1
+                feed_uuids = [
+                    feed_uuid for (feed_uuid,) in
+                    session.query(Feed.uuid).join(feed_tracks).filter(feed_tracks.c.track_id.in_(changed)).distinct()
+                ]
+                session.commit()
+                for feed_uuid in feed_uuids:
+                    feed_cache.invalidate(feed_uuid)
+                for row in rows:
+                    if row.id in fixed:
+                        missing_files.invalidate((row.uuid, row.file_name))
+            return rows[-1].id
+        finally:
+            session.close()
+
+    def _check_orphans(self, last_id: int, stats: dict) -> Optional[int]:
+        """Quarantine unreferenced mp3 files of a batch of users after `last_id`; returns the last id or None"""
+        session = self.session_factory()
+        try:
+            users = (
+                session.query(User.id, User.uuid)
+                .filter(User.id > last_id)
+                .order_by(User.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not users:
+                return None
+            known = defaultdict(set)
+            for user_uuid, file_name in (
+                session.query(User.uuid, Track.file_name).join(Track).filter(User.id.in_([u.id for u in users]))
+            ):
+                known[user_uuid].add(file_name)
+        finally:
+            session.close()
+
+        now = time.time()
+        for user in users:
+            user_dir = f"data/{user.uuid}"
+            if not os.path.isdir(user_dir):
+                continue
+            for entry in os.scandir(user_dir):
+                if not entry.name.endswith('.mp3') or entry.name in known[user.uuid]:
+                    continue
+                # ctime: imports and hard links of old staged files keep an old mtime
+                if now - last_change(entry.path) < ORPHAN_MIN_AGE:
+                    continue
+                stat = entry.stat()
+                logger.info(f"Quarantined orphan file {quarantine(entry.path, user.uuid)}")
+                self._verified.pop(entry.path, None)
+                stats['orphaned'] += 1
+                stats['quarantined'] += 1
+                stats['orphaned_bytes'] += stat.st_size
+                INTEGRITY_PROBLEMS.labels('orphaned').inc()
+        return users[-1].id
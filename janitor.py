@@ -0,0 +1,80 @@
+import logging
+import os
+import time
+from collections import defaultdict
+
+from sqlalchemy.orm import sessionmaker
+
+from ingest import DOWNLOADS_DIR, remove_staging, staging_dir
+from models import DownloadJob, Track, User
+
+logger = logging.getLogger(__name__)
+
+# Files and staging dirs changed after this process started, or recently,
+# may belong to a live upload or a running snapshot import, not a crash
+STARTED_AT = time.time()
+STALE_AFTER = 3600
+
+
+def last_change(path: str) -> float:
+    """Latest ctime of `path` and, for a directory, of its entries (ctime can't be set back like mtime)"""
+    latest = os.lstat(path).st_ctime
+    if os.path.isdir(path):
+        for entry in os.scandir(path):
+            latest = max(latest, entry.stat(follow_symlinks=False).st_ctime)
+    return latest
+
+
+def reconcile_storage(session_factory: sessionmaker) -> dict:
+    """Bring the data directory back in line with the database after a restart.
+
+    Must run before any new downloads start: it removes staging directories
+    that don't belong to a pending DownloadJob, half-published temporary
+    files, and moves mp3 files without a Track row (left when the process
+    died between publishing a file and committing its track) to the
+    quarantine like the integrity scanner does. The server takes
+    uploads while this runs, so anything changed since this process
+    started or within STALE_AFTER is left alone.
+
+    Returns:
+        dict: Counters of what was cleaned up
+    """
+    from integrity import quarantine
+
+    stats = defaultdict(int)
+    cutoff = min(STARTED_AT, time.time() - STALE_AFTER)
+    session = session_factory()
+    try:
+        pending = {staging_dir(job.video_key, job.profile) for job in session.query(DownloadJob)}
+        if os.path.isdir(DOWNLOADS_DIR):
+            for name in os.listdir(DOWNLOADS_DIR):
+                path = f"{DOWNLOADS_DIR}/{name}"
+                if path not in pending and last_change(path) < cutoff:
+                    remove_staging(path)
+                    stats['staging_removed'] += 1
+
+        known_files = defaultdict(set)
+        for user_uuid, file_name in session.query(User.uuid, Track.file_name).join(Track):
+            known_files[user_uuid].add(file_name)
+
+        for (user_uuid,) in session.query(User.uuid):
+            user_dir = f"data/{user_uuid}"
+            if not os.path.isdir(user_dir):
+                continue
+            for file in os.listdir(user_dir):
+                file_path = os.path.join(user_dir, file)
+                if last_change(file_path) >= cutoff:
+                    continue
+                if file.startswith('.') and file.endswith('.tmp'):
+                    os.remove(file_path)
+                    stats['tmp_removed'] += 1
+                elif file.endswith('.mp3') and file not in known_files[user_uuid]:
+                    logger.info(f"Quarantined orphan file {quarantine(file_path, user_uuid)}")
+                    stats['orphans_quarantined'] += 1
+            for file_name in known_files[user_uuid]:
+                if not os.path.exists(os.path.join(user_dir, file_name)):
+                    logger.warning(f"Track file is missing: {user_dir}/{file_name}")
+                    stats['missing_files'] += 1
+    finally:
+        session.close()
+    return dict(stats)
@@ -0,0 +1,134 @@
+import base64
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query, Session
+
+from cache import feed_cache, missing_files
+from ingest import publish_file
+from models import DownloadJob, Feed, Track, feed_tracks
+from search import filter_search
+
+
+def link_existing_track(session: Session, user_id: int, feed_id: int, file_name: str) -> Optional[str]:
+    """Add the user's already stored track to the feed, without committing
+
+    Returns:
+        Optional[str]: Title of the track, None if the user has no such track
+    """
+    track = session.query(Track).filter_by(user_id=user_id, file_name=file_name).first()
+    if track is None:
+        return None
+    feed = session.get(Feed, feed_id)
+    if feed not in track.feeds:
+        track.feeds.append(feed)
+    return track.title
+
+
+def store_track(session: Session, staged_path: str, user_uuid: str, feed_id: int,
+                job: Optional[DownloadJob] = None, **fields) -> Track:
+    """Publish a staged mp3 into the user's directory and add its Track to the feed.
+
+    The Track insert (and deletion of the finished `job`, if any) is
+    committed together; if that fails the published file is removed again,
+    so no file is left without its track.
+
+    Args:
+        session: Active database session
+        staged_path: Finished file in a staging directory
+        user_uuid: Owner of the track, names the target directory
+        feed_id: Feed to list the track in
+        job: DownloadJob the track completes
+        **fields: Track columns, including user_id and file_name
+    """
+    file_path = f"data/{user_uuid}/{fields['file_name']}"
+    publish_file(staged_path, file_path)
+    try:
+        feed = session.get(Feed, feed_id)
+        track = Track(feeds=[feed], **fields)
+        session.add(track)
+        if job is not None:
+            session.delete(job)
+        session.commit()
+    except Exception:
+        session.rollback()
+        os.remove(file_path)
+        raise
+    feed_cache.invalidate(feed.uuid)
+    missing_files.invalidate((user_uuid, fields['file_name']))
+    return track
+
+
+def feed_tracks_query(session: Session, feed_id: int, search: Optional[str] = None) -> Query:
+    """Tracks of the feed, newest first, optionally only those matching `search`"""
+    query = (
+        session.query(Track)
+        .join(feed_tracks)
+        .filter(feed_tracks.c.feed_id == feed_id)
+        .order_by(Track.created_at.desc(), Track.id.desc())
+    )
+    return filter_search(session, query, search) if search else query
+
+
+def user_tracks_query(session: Session, user_id: int, search: Optional[str] = None) -> Query:
+    """Tracks of all the user's feeds, newest first, optionally only those matching `search`"""
+    query = session.query(Track).filter_by(user_id=user_id).order_by(Track.created_at.desc(), Track.id.desc())
+    return filter_search(session, query, search) if search else query
+
+
+def encode_cursor(track: Track) -> str:
+    raw = f"{track.created_at.isoformat()}|{track.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(created_at, id) of the last track of the previous page; ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, track_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(track_id)
+    except (TypeError, UnicodeDecodeError) as e:
+        raise ValueError("Malformed cursor") from e
+
+
+def paginate(query: Query, limit: int, cursor: Optional[str] = None) -> tuple:
+    """One page of a track query ordered newest first, with keyset pagination.
+
+    Pages continue after the (created_at, id) of the previous page's last
+    track instead of using OFFSET, so deep pages cost the same as the first
+    one and tracks added meanwhile don't shift the pages.
+
+    Returns:
+        tuple: (tracks, next cursor or None on the last page)
+    """
+    if cursor:
+        query = query.filter(tuple_(Track.created_at, Track.id) < decode_cursor(cursor))
+    tracks = query.limit(limit + 1).all()
+    if len(tracks) > limit:
+        return tracks[:limit], encode_cursor(tracks[limit - 1])
+    return tracks, None
+
+
+def remove_tracks(session: Session, user_uuid: str, feed: Feed, tracks: list[Track]):
+    """Take the tracks out of the feed and commit.
+
+    Tracks that aren't listed in any other feed of the user are deleted
+    together with their files.
+    """
+    orphaned = []
+    for track in tracks:
+        if feed in track.feeds:
+            track.feeds.remove(feed)
+        # The episode may still be listed in the user's other feeds
+        if not track.feeds:
+            orphaned.append(track.file_name)
+            session.delete(track)
+    session.commit()
+    feed_cache.invalidate(feed.uuid)
+    for file_name in orphaned:
+        try:
+            os.remove(f"data/{user_uuid}/{file_name}")
+        except OSError:
+            pass  # File might not exist
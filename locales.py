@@ -1,10 +1,43 @@
-from typing import Dict, Any
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from string import Formatter
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def validate_template(template: str) -> str:
+    """Validate a str.format template before it is used
+
+    Raises ValueError for broken templates (unbalanced braces, positional
+    fields), so a bad catalog fails at load time rather than mid-reply.
+    """
+    for _, field, _, _ in Formatter().parse(template):
+        if field is not None and not field:
+            raise ValueError(f"Positional field in template: {template!r}")
+    return template
+
 
 class Locale:
-    def __init__(self, code: str, name: str, translations: Dict[str, Any]):
+    def __init__(self, code: str, name: str, translations: Dict[str, Any], feed_language: Optional[str] = None):
         self.code = code
         self.name = name
         self.translations = translations
+        self.feed_language = feed_language or code
+        self.templates = {}
+
+    def build(self, fallback: Optional['Locale'] = None):
+        """Build the lookup table, filling keys missing here from `fallback`
+
+        Resolving fallbacks once here leaves a single dict lookup per render;
+        the templates themselves are still formatted with str.format.
+        """
+        translations = {**(fallback.translations if fallback else {}), **self.translations}
+        self.templates = {key: validate_template(text) for key, text in translations.items()}
 
 # English translations
 EN = {
@@ -43,7 +76,14 @@ EN = {
         "• `/setimage` - Set your podcast cover image\n"
         "• `/list` - Show list of added videos\n"
         "• `/delete` - Delete video from the list\n"
+        "• `/search <words>` - Find episodes in all your feeds\n"
         "• `/feed` - Get your podcast RSS feed\n"
+        "• `/feeds` - List your feeds\n"
+        "• `/newfeed <title>` - Create another feed\n"
+        "• `/usefeed <number>` - Choose the feed for new videos\n"
+        "• `/feedprofile <profile>` - Audio quality of the current feed\n"
+        "• `/upload` - Link for uploading large audio or video files\n"
+        "• `/web` - Manage your episodes in the browser\n"
         "• `/help` - Show this help message\n\n"
         "💡 *Tips*\n"
         "• Your feed updates automatically when you add new videos\n\n"
@@ -66,6 +106,18 @@ EN = {
         "{tracks}\n\n"
         "Use /delete to remove videos from your feed."
     ),
+    'list_page': "Page {page} of {pages}",
+    'list_prev': "◀️ Newer",
+    'list_next': "Older ▶️",
+    'list_more': "...and {count} more, see /list",
+    'search_usage': (
+        "🔎 *Search your episodes*\n\n"
+        "Usage: `/search <words>`\n"
+        "Looks through titles, channels and descriptions of all your feeds."
+    ),
+    'search_empty': "🔎 Nothing found for *{query}*",
+    'search_results': "🔎 *Results for {query}*\n\n{tracks}",
+    'search_more': "...and {count} more, refine the search or use /web",
     'delete_invalid': (
         "❌ *Invalid command format*\n\n"
         "Usage: `/delete <number>`\n\n"
@@ -93,7 +145,61 @@ EN = {
         "❌ *Error setting image*\n\n"
         "Please try again or use a different image."
     ),
+    'feeds': (
+        "🗂 *Your feeds*\n\n"
+        "{feeds}\n\n"
+        "New videos are added to the feed marked ▶️\n"
+        "• /usefeed <number> - switch feed\n"
+        "• /newfeed <title> - create a feed\n"
+        "• /feedprofile <profile> - audio quality of the current feed"
+    ),
+    'feeds_item': (
+        "{marker} {number}. *{title}* - {track_count} episodes, {profile}\n"
+        "`{rss_url}`"
+    ),
+    'feed_default_title': "Main feed",
+    'newfeed_usage': "Usage: `/newfeed <title>`",
+    'newfeed_limit': "❌ You can have at most {limit} feeds",
+    'newfeed_success': (
+        "✅ *Feed created: {title}*\n\n"
+        "New videos will be added to it. Add it to your podcast app:\n"
+        "`{rss_url}`\n\n"
+        "Use /setimage to give it a cover."
+    ),
+    'usefeed_invalid': (
+        "❌ *Invalid feed number*\n\n"
+        "Usage: `/usefeed <number>`\n\n"
+        "{feeds}"
+    ),
+    'usefeed_success': "✅ New videos will be added to *{title}*",
+    'feedprofile_usage': (
+        "Usage: `/feedprofile <profile>`\n\n"
+        "Current: *{profile}*\n"
+        "Available: {profiles}"
+    ),
+    'feedprofile_success': "✅ New videos in *{title}* will be encoded as *{profile}*",
+    'web_link': (
+        "🌐 *Your library in the browser*\n\n"
+        "Search, browse and delete episodes of all your feeds. The link is valid for 7 days, don't share it:\n"
+        "{web_url}"
+    ),
+    'upload_link': (
+        "📤 *Upload files to {title}*\n\n"
+        "Open this link to upload audio or video files of any size, it is valid for 24 hours:\n"
+        "{upload_url}"
+    ),
+    'upload_too_large': (
+        "📦 *This file is too large for Telegram bots* (20 MB limit)\n\n"
+        "Upload it through this link instead, it is valid for 24 hours:\n"
+        "{upload_url}"
+    ),
+    'upload_processing': "🎛 Processing your file...",
+    'upload_error': "Error processing file: {error}",
+    'upload_default_title': "Upload from {date}",
     'download_start': "Downloading and processing your video...",
+    'download_progress': "⬇️ Downloading: {percent}\nSpeed: {speed} • ETA: {eta}",
+    'download_converting': "🎛 Converting to MP3...",
+    'download_in_progress': "⏳ This video is already downloading, I'll let you know when it's ready.",
     'download_success': "Successfully added '{title}' to your podcast feed!",
     'download_error': "Error processing video: {error}",
     'start_first': "❌ Please use /start first",
@@ -107,11 +213,32 @@ EN = {
         "{stats}"
     ),
     'no_users': "No users found",
+    'feed_channel': "Channel: {channel}",
+    'feed_video_link': "Video link: {url}",
+    'feed_description': "Description: {description}",
     'track_item': "{number}. {title} - [(YouTube)]({url})",
+    'track_item_upload': "{number}. {title}",
+    'track_item_link': "{number}. {title} - [(link)]({url})",
+    'rate_limited': "⏳ Too many messages, please wait {seconds} s and try again.",
+    'ingest_rate_limited': "⏳ You are adding videos too fast, the next one can be added in {seconds} s.",
+    'unsupported_url': "❌ This link isn't supported. Send a video link from: {sites}",
+    'any_site': "any site supported by yt-dlp",
     'stats_item': (
         "👤 @{username} (ID: {user_id}):\n"
         "   • Tracks: {track_count}\n"
         "   • Storage: {storage}"
+    ),
+    'stats_integrity': (
+        "\n🩺 Storage check ({finished_at}):\n"
+        "   • Files checked: {checked}\n"
+        "   • Missing: {missing}, damaged: {damaged}\n"
+        "   • Orphaned: {orphaned} ({orphaned_size})\n"
+        "   • Quarantined: {quarantined}, restored: {repaired}\n"
+        "   • Episodes without a file: {broken}"
+    ),
+    'stats_integrity_pending': (
+        "\n🩺 Storage check is still running\n"
+        "   • Episodes without a file: {broken}"
     )
 }
 
@@ -152,7 +279,14 @@ RU = {
         "• `/setimage` - Установить обложку подкаста\n"
         "• `/list` - Показать список добавленных видео\n"
         "• `/delete` - Удалить видео из списка\n"
+        "• `/search <слова>` - Найти эпизоды во всех лентах\n"
         "• `/feed` - Получить RSS-ленту подкаста\n"
+        "• `/feeds` - Список ваших лент\n"
+        "• `/newfeed <название>` - Создать еще одну ленту\n"
+        "• `/usefeed <номер>` - Выбрать ленту для новых видео\n"
+        "• `/feedprofile <профиль>` - Качество звука текущей ленты\n"
+        "• `/upload` - Ссылка для загрузки больших аудио и видео файлов\n"
+        "• `/web` - Управление эпизодами в браузере\n"
         "• `/help` - Показать это сообщение\n\n"
         "💡 *Советы*\n"
         "• Ваша лента обновляется автоматически при добавлении новых видео\n\n"
@@ -175,6 +309,18 @@ RU = {
         "{tracks}\n\n"
         "Используйте /delete для удаления видео из ленты."
     ),
+    'list_page': "Страница {page} из {pages}",
+    'list_prev': "◀️ Новее",
+    'list_next': "Старее ▶️",
+    'list_more': "...и еще {count}, см. /list",
+    'search_usage': (
+        "🔎 *Поиск по эпизодам*\n\n"
+        "Использование: `/search <слова>`\n"
+        "Ищет по названиям, каналам и описаниям во всех ваших лентах."
+    ),
+    'search_empty': "🔎 По запросу *{query}* ничего не найдено",
+    'search_results': "🔎 *Результаты по запросу {query}*\n\n{tracks}",
+    'search_more': "...и еще {count}, уточните запрос или откройте /web",
     'delete_invalid': (
         "❌ *Неверный формат команды*\n\n"
         "Использование: `/delete <номер>`\n\n"
@@ -202,7 +348,61 @@ RU = {
         "❌ *Ошибка установки обложки*\n\n"
         "Пожалуйста, попробуйте еще раз или используйте другое изображение."
     ),
+    'feeds': (
+        "🗂 *Ваши ленты*\n\n"
+        "{feeds}\n\n"
+        "Новые видео добавляются в ленту, отмеченную ▶️\n"
+        "• /usefeed <номер> - выбрать ленту\n"
+        "• /newfeed <название> - создать ленту\n"
+        "• /feedprofile <профиль> - качество звука текущей ленты"
+    ),
+    'feeds_item': (
+        "{marker} {number}. *{title}* - выпусков: {track_count}, {profile}\n"
+        "`{rss_url}`"
+    ),
+    'feed_default_title': "Основная лента",
+    'newfeed_usage': "Использование: `/newfeed <название>`",
+    'newfeed_limit': "❌ Можно создать не больше {limit} лент",
+    'newfeed_success': (
+        "✅ *Лента создана: {title}*\n\n"
+        "Новые видео будут добавляться в нее. Добавьте ее в приложение для подкастов:\n"
+        "`{rss_url}`\n\n"
+        "Используйте /setimage, чтобы задать обложку."
+    ),
+    'usefeed_invalid': (
+        "❌ *Неверный номер ленты*\n\n"
+        "Использование: `/usefeed <номер>`\n\n"
+        "{feeds}"
+    ),
+    'usefeed_success': "✅ Новые видео будут добавляться в *{title}*",
+    'feedprofile_usage': (
+        "Использование: `/feedprofile <профиль>`\n\n"
+        "Текущий: *{profile}*\n"
+        "Доступные: {profiles}"
+    ),
+    'feedprofile_success': "✅ Новые видео в *{title}* будут кодироваться как *{profile}*",
+    'web_link': (
+        "🌐 *Ваша библиотека в браузере*\n\n"
+        "Поиск, просмотр и удаление эпизодов всех ваших лент. Ссылка действует 7 дней, не передавайте ее другим:\n"
+        "{web_url}"
+    ),
+    'upload_link': (
+        "📤 *Загрузка файлов в {title}*\n\n"
+        "По этой ссылке можно загрузить аудио или видео любого размера, она действует 24 часа:\n"
+        "{upload_url}"
+    ),
+    'upload_too_large': (
+        "📦 *Файл слишком большой для Telegram-бота* (лимит 20 МБ)\n\n"
+        "Загрузите его по этой ссылке, она действует 24 часа:\n"
+        "{upload_url}"
+    ),
+    'upload_processing': "🎛 Обрабатываю файл...",
+    'upload_error': "Ошибка обработки файла: {error}",
+    'upload_default_title': "Загрузка от {date}",
     'download_start': "Скачиваю и обрабатываю ваше видео...",
+    'download_progress': "⬇️ Загрузка: {percent}\nСкорость: {speed} • Осталось: {eta}",
+    'download_converting': "🎛 Конвертирую в MP3...",
+    'download_in_progress': "⏳ Это видео уже скачивается, я сообщу, когда оно будет готово.",
     'download_success': "Видео '{title}' успешно добавлено в ваш подкаст!",
     'download_error': "Ошибка обработки видео: {error}",
     'start_first': "❌ Пожалуйста, сначала используйте /start",
@@ -216,26 +416,160 @@ RU = {
         "{stats}"
     ),
     'no_users': "Пользователи не найдены",
+    'feed_channel': "Канал: {channel}",
+    'feed_video_link': "Ссылка на видео: {url}",
+    'feed_description': "Описание: {description}",
     'track_item': "{number}. {title} - [(YouTube)]({url})",
+    'track_item_upload': "{number}. {title}",
+    'track_item_link': "{number}. {title} - [(ссылка)]({url})",
+    'rate_limited': "⏳ Слишком много сообщений, подождите {seconds} с и попробуйте снова.",
+    'ingest_rate_limited': "⏳ Вы добавляете видео слишком часто, следующее можно будет добавить через {seconds} с.",
+    'unsupported_url': "❌ Эта ссылка не поддерживается. Отправьте ссылку на видео с: {sites}",
+    'any_site': "любой сайт, который поддерживает yt-dlp",
     'stats_item': (
         "👤 @{username} (ID: {user_id}):\n"
         "   • Треков: {track_count}\n"
         "   • Место: {storage}"
+    ),
+    'stats_integrity': (
+        "\n🩺 Проверка хранилища ({finished_at}):\n"
+        "   • Проверено файлов: {checked}\n"
+        "   • Отсутствуют: {missing}, повреждены: {damaged}\n"
+        "   • Лишние: {orphaned} ({orphaned_size})\n"
+        "   • В карантине: {quarantined}, восстановлено: {repaired}\n"
+        "   • Эпизодов без файла: {broken}"
+    ),
+    'stats_integrity_pending': (
+        "\n🩺 Проверка хранилища еще идет\n"
+        "   • Эпизодов без файла: {broken}"
     )
 }
 
 # Available locales
 LOCALES = {
-    'en': Locale('en', 'English', EN),
-    'ru': Locale('ru', 'Русский', RU)
+    'en': Locale('en', 'English', EN, feed_language='en-us'),
+    'ru': Locale('ru', 'Русский', RU, feed_language='ru-ru')
 }
+DEFAULT_LANGUAGE = 'en'
+# Catalog files are applied on top of these, never on top of an earlier load
+_BUILTIN_LOCALES = dict(LOCALES)
+
+
+def _build_all(locales: Dict[str, Locale]):
+    fallback = locales[DEFAULT_LANGUAGE]
+    fallback.build()
+    for locale in locales.values():
+        if locale is not fallback:
+            locale.build(fallback)
+
+
+_build_all(LOCALES)
+
+
+class CatalogLoader:
+    """Loads extra or overriding catalogs from `{code}.json` files in a directory
+
+    Each file maps keys to templates; optional `_name` and `_feed_language`
+    entries describe the locale and other keys fall back to the built-in
+    locale of that code. Files are re-read when their mtime changes,
+    checked at most every `interval` seconds, so translations can be fixed
+    without a restart.
+    """
+
+    def __init__(self, directory: str, interval: float = 5.0):
+        self.directory = directory
+        self.interval = interval
+        self._mtimes = {}
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.interval
+            try:
+                self.reload()
+            except Exception as e:
+                # Keep serving the locales loaded so far
+                logger.error(f"Error reloading locale catalogs: {e}", exc_info=True)
+
+    def reload(self):
+        global LOCALES
+        try:
+            files = [f for f in os.listdir(self.directory) if f.endswith('.json')]
+        except OSError as e:
+            logger.warning(f"Can't read locales directory {self.directory}: {e}")
+            return
+        mtimes = {f: os.stat(os.path.join(self.directory, f)).st_mtime for f in files}
+        if mtimes == self._mtimes:
+            return
+        # Built aside and swapped in whole, readers never see a half-built locale
+        locales = dict(LOCALES)
+        for file in self._mtimes.keys() - mtimes.keys():
+            code = file[:-len('.json')]
+            if code in _BUILTIN_LOCALES:
+                locales[code] = _BUILTIN_LOCALES[code]
+            else:
+                locales.pop(code, None)
+            logger.info(f"Removed locale catalog {file}")
+        for file in files:
+            if self._mtimes.get(file) == mtimes[file]:
+                continue
+            code = file[:-len('.json')]
+            try:
+                with open(os.path.join(self.directory, file), encoding='utf-8') as f:
+                    catalog = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading locale catalog {file}: {e}")
+                continue
+            try:
+                if not isinstance(catalog, dict) or not all(isinstance(text, str) for text in catalog.values()):
+                    raise ValueError("expected an object of strings")
+                for text in catalog.values():
+                    validate_template(text)
+            except ValueError as e:
+                logger.error(f"Error in locale catalog {file}: {e}")
+                continue
+            base = _BUILTIN_LOCALES.get(code)
+            name = catalog.pop('_name', base.name if base else code)
+            feed_language = catalog.pop('_feed_language', base.feed_language if base else code)
+            translations = {**(base.translations if base else {}), **catalog}
+            locales[code] = Locale(code, name, translations, feed_language=feed_language)
+            logger.info(f"Loaded locale catalog {file} ({len(catalog)} keys)")
+        _build_all(locales)
+        LOCALES = locales
+        self._mtimes = mtimes
+        normalize_language.cache_clear()
+
+
+_loader = CatalogLoader(os.environ['LOCALES_DIR']) if os.getenv('LOCALES_DIR') else None
+
+
+@lru_cache(maxsize=256)
+def normalize_language(language_code: Optional[str]) -> str:
+    """Map a client language code ("ru-RU", "pt-br", None) to an available locale code"""
+    if not language_code:
+        return DEFAULT_LANGUAGE
+    code = language_code.lower()
+    if code in LOCALES:
+        return code
+    code = code.replace('_', '-').split('-')[0]
+    return code if code in LOCALES else DEFAULT_LANGUAGE
+
 
 def get_locale(language_code: str) -> Locale:
     """Get locale by language code, fallback to English if not found"""
-    return LOCALES.get(language_code, LOCALES['en'])
+    if _loader:
+        _loader.maybe_reload()
+    # The normalized code may be cached from before a catalog was removed
+    return LOCALES.get(language_code) or LOCALES.get(normalize_language(language_code)) or LOCALES[DEFAULT_LANGUAGE]
+
 
 def get_text(language_code: str, key: str, **kwargs) -> str:
     """Get localized text by key with optional formatting"""
-    locale = get_locale(language_code)
-    text = locale.translations.get(key, LOCALES['en'].translations.get(key, key))
-    return text.format(**kwargs) if kwargs else text 
\ No newline at end of file
+    text = get_locale(language_code).templates.get(key, key)
+    return text.format(**kwargs) if kwargs else text
@@ -0,0 +1,219 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import traceback
+from datetime import datetime, timezone
+from typing import IO, Optional
+
+# Request-scoped fields added to every record logged while handling it
+request_id_var = contextvars.ContextVar('request_id', default=None)
+user_id_var = contextvars.ContextVar('user_id', default=None)
+
+ACCESS_LOGGER = 'access'
+
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the current request/user ids in the logging thread"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id'):
+            record.request_id = request_id_var.get()
+        if not hasattr(record, 'user_id'):
+            record.user_id = user_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Passes only a `rate` share of records below WARNING from the given loggers"""
+
+    def __init__(self, loggers: tuple, rate: float):
+        super().__init__()
+        self.loggers = loggers
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not record.name.startswith(self.loggers):
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    # Standard LogRecord attributes; anything else was passed via `extra`
+    _reserved = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._reserved and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Keeps records structured on their way to the listener thread
+
+    The stock handler formats the record into a plain string in prepare();
+    here only the message and traceback are rendered (they may reference
+    objects that change later), extra fields are kept as they are.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+
+def _parse_levels(spec: str) -> dict:
+    """Parse "bot=DEBUG,uvicorn.access=WARNING" into {logger: level}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level: Optional[str] = None, stream: Optional[IO] = None):
+    """Route all logging through a queue to a background writer thread.
+
+    Handlers only enqueue records, so a slow stdout never blocks the event
+    loop. Logs go to `stream`, stdout by default. Configured from the environment:
+        LOG_LEVEL          root level (INFO)
+        LOG_LEVELS         per-logger levels, e.g. "bot=DEBUG,httpx=WARNING"
+        LOG_FORMAT         "json" (default) or "text"
+        ACCESS_LOG_SAMPLE  share of access log lines below WARNING to keep (1.0)
+    """
+    global _listener
+    if _listener:
+        return
+
+    if os.getenv('LOG_FORMAT', 'json') == 'text':
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    else:
+        formatter = JsonFormatter()
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    sample_rate = float(os.getenv('ACCESS_LOG_SAMPLE', '1.0'))
+    if sample_rate < 1.0:
+        handler.addFilter(SamplingFilter((ACCESS_LOGGER, 'uvicorn.access'), sample_rate))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+    # httpx logs every Telegram API call at INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    for name, logger_level in _parse_levels(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(logger_level)
+    # Let uvicorn's loggers propagate to ours instead of writing themselves
+    for name in ('uvicorn', 'uvicorn.error', 'uvicorn.access'):
+        logging.getLogger(name).handlers.clear()
+        logging.getLogger(name).propagate = True
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+def log_context(callback):
+    """Bind user/request ids for a telegram handler and log how long it took"""
+    logger = logging.getLogger(callback.__module__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user_token = user_id_var.set(update.effective_user.id if update.effective_user else None)
+        request_token = request_id_var.set(f"tg-{update.update_id}")
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            logger.debug(
+                f"Handled update with {callback.__name__}",
+                extra={'duration_ms': round((time.perf_counter() - start) * 1000, 1)}
+            )
+            user_id_var.reset(user_token)
+            request_id_var.reset(request_token)
+    return wrapper
+
+
+class AccessLogMiddleware:
+    """ASGI middleware: request ids and one structured access log line per request
+
+    Uses the client's X-Request-ID when present and echoes it back.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger(ACCESS_LOGGER)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_id = dict(scope['headers']).get(b'x-request-id', b'').decode('latin-1')[:64] or os.urandom(8).hex()
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def send_wrapper(message):
+            nonlocal status, sent
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = [*message.get('headers', []), (b'x-request-id', request_id.encode('latin-1'))]
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            client = scope.get('client')
+            self.logger.info(
+                f"{scope['method']} {scope['path']} {status}",
+                extra={
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'status': status,
+                    'bytes': sent,
+                    'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+                    'client': client[0] if client else None,
+                }
+            )
+            request_id_var.reset(token)
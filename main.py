@@ -1,27 +1,23 @@
 import os
 import asyncio
+import importlib
 import logging
 from dotenv import load_dotenv
-from sqlalchemy.orm import sessionmaker
-from models import init_db
-from bot import PodcastBot
+
+# Load environment variables before anything reads them: logging and
+# several modules take their settings from the environment on import
+load_dotenv()
+
+from logs import setup_logging
 from server import app
+from database import SessionLocal
 import uvicorn
-import sys
 import signal
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    stream=sys.stdout
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-logger.info("Loading environment variables...")
-load_dotenv()
-
 token = os.getenv("TELEGRAM_BOT_TOKEN")
 if not token:
     logger.error("TELEGRAM_BOT_TOKEN is not set in .env file!")
@@ -32,11 +28,9 @@ logger.info(f"DOMAIN is set to: {domain}")
 admin_id = os.getenv("ADMIN_ID")
 logger.info(f"ADMIN_ID is set to: {admin_id}")
 
-# Initialize database
+# The database is initialized by the server on startup
 DATABASE_URL = os.getenv("DATABASE_URL")
 logger.info(f"Using database URL: {DATABASE_URL}")
-engine = init_db(DATABASE_URL)
-Session = sessionmaker(bind=engine)
 
 bot_instance = None
 server = None
@@ -47,41 +41,63 @@ def handle_exit(signum, frame):
     if server:
         server.should_exit = True
 
+async def preload_dependencies(preload):
+    """Run `preload` in a thread; a failure only means the first download imports them"""
+    try:
+        await asyncio.to_thread(preload)
+    except Exception as e:
+        logger.warning(f"Preloading download dependencies failed: {e}", exc_info=True)
+
 async def main():
     global server, bot_instance
     # Set up signal handlers
     signal.signal(signal.SIGINT, handle_exit)
     signal.signal(signal.SIGTERM, handle_exit)
 
-    # Создаем бота
-    bot_instance = PodcastBot(
-        token=token,
-        domain=domain,
-        session_factory=Session,
-        admin_id=int(admin_id)
-    )
-
     # Создаем сервер
     config = uvicorn.Config(
         app,
         host="0.0.0.0",
         port=8000,
         log_level="info",
-        access_log=True
+        # Requests are logged by AccessLogMiddleware, logging is set up by setup_logging
+        access_log=False,
+        log_config=None,
+        # Client addresses (used for rate limiting) come from X-Forwarded-For set by these proxies
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
     )
     server = uvicorn.Server(config)
 
-    # Запускаем обе задачи параллельно
-    bot_task = asyncio.create_task(bot_instance.start())
+    # Feeds are served first; the bot and the download stack are imported
+    # and started once the server is up, so podcast apps don't wait for them
     server_task = asyncio.create_task(server.serve())
+    while not server.started and not server_task.done():
+        await asyncio.sleep(0.05)
+    if server_task.done():
+        await server_task
+        return
+
+    bot_module = await asyncio.to_thread(importlib.import_module, 'bot')
+    from ingest import preload
+    bot_instance = bot_module.PodcastBot(
+        token=token,
+        domain=domain,
+        session_factory=SessionLocal,
+        admin_id=int(admin_id)
+    )
+    # Запускаем бота параллельно с сервером
+    bot_task = asyncio.create_task(bot_instance.start())
+    # Warm up yt-dlp in the background instead of on the first download
+    preload_task = asyncio.create_task(preload_dependencies(preload))
 
     done, pending = await asyncio.wait(
         [bot_task, server_task],
         return_when=asyncio.FIRST_COMPLETED
     )
 
-    # Если одна из задач завершилась — останавливаем вторую
-    for task in pending:
+    # Если одна из задач завершилась — останавливаем вторую и прогрев, если он еще идет
+    for task in [*pending, preload_task]:
         task.cancel()
         try:
             await task
@@ -0,0 +1,154 @@
+import functools
+import time
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from cache import feed_cache, missing_feeds, missing_files, user_cache
+
+# Feed serving
+FEED_BUILD_SECONDS = Histogram(
+    'feed_build_seconds', 'Time to render an RSS feed',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_seconds', 'HTTP request handling time until response headers', ['endpoint', 'status'],
+)
+HTTP_RESPONSE_BYTES = Counter(
+    'http_response_bytes_total', 'Response body bytes sent', ['endpoint'],
+)
+
+# Database
+DB_QUERY_SECONDS = Histogram(
+    'db_query_seconds', 'SQL statement execution time', ['statement'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+# Ingest
+DOWNLOAD_SECONDS = Histogram(
+    'ytdlp_download_seconds', 'yt-dlp download time, excluding post-processing',
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200),
+)
+TRANSCODE_SECONDS = Histogram(
+    'ffmpeg_transcode_seconds', 'ffmpeg post-processing time', ['postprocessor'],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+INGESTS = Counter('ingests_total', 'Finished ingest jobs', ['result'])
+DOWNLOADS_IN_FLIGHT = Gauge('downloads_in_flight', 'Distinct downloads currently running')
+INGEST_WAITERS = Gauge('ingest_requests_in_flight', 'Ingest requests waiting for a download')
+DOWNLOADS_WAITING = Gauge('downloads_waiting', 'Downloads queued for a per-extractor slot', ['extractor'])
+
+MEDIA_HELPER_SECONDS = Histogram(
+    'media_helper_seconds', 'Cover processing and storage accounting time', ['helper'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+# Abuse protection
+RATE_LIMITED = Counter('rate_limited_total', 'Requests rejected by a rate limiter', ['limiter'])
+
+# Storage
+INTEGRITY_PROBLEMS = Counter(
+    'integrity_problems_total', 'Missing, corrupt and orphaned files found by the integrity scanner', ['kind'],
+)
+INTEGRITY_LAST_SCAN = Gauge('integrity_last_scan_timestamp_seconds', 'When the last integrity scan finished')
+
+# Bot
+BOT_HANDLER_SECONDS = Histogram(
+    'bot_handler_seconds', 'Telegram update handler latency', ['handler'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+
+
+class _CacheCollector:
+    """Exposes hit/miss counters the caches keep themselves"""
+
+    caches = {
+        'user_by_telegram_id': user_cache.by_telegram_id,
+        'user_by_uuid': user_cache.by_uuid,
+        'rss_feed': feed_cache,
+        'missing_user_by_telegram_id': user_cache.missing_by_telegram_id,
+        'missing_user_by_uuid': user_cache.missing_by_uuid,
+        'missing_feed': missing_feeds,
+        'missing_file': missing_files,
+    }
+
+    def collect(self):
+        family = CounterMetricFamily('cache_requests', 'Cache lookups', labels=['cache', 'result'])
+        for name, cache in self.caches.items():
+            family.add_metric([name, 'hit'], cache.hits)
+            family.add_metric([name, 'miss'], cache.misses)
+        yield family
+
+
+REGISTRY.register(_CacheCollector())
+
+
+def instrument_engine(engine: Engine):
+    """Record execution time of every statement run through `engine`"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        DB_QUERY_SECONDS.labels(statement.lstrip().split(None, 1)[0].upper()).observe(elapsed)
+
+
+def timed_handler(name: str, callback):
+    """Wrap a telegram handler callback to record its latency"""
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with BOT_HANDLER_SECONDS.labels(name).time():
+            return await callback(update, context)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and bytes sent per endpoint
+
+    Bytes are counted from the body actually sent, so Range requests for
+    audio are accounted for correctly.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        sent = 0
+        content_length = 0
+
+        async def send_wrapper(message):
+            nonlocal sent, content_length
+            if message['type'] == 'http.response.start':
+                HTTP_REQUEST_SECONDS.labels(_endpoint(scope), str(message['status'])).observe(
+                    time.perf_counter() - start
+                )
+                for name, value in message.get('headers', []):
+                    if name.lower() == b'content-length':
+                        content_length = int(value)
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            elif message['type'] == 'http.response.pathsend':
+                # Zero-copy file responses don't pass the body through us
+                sent += content_length
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_RESPONSE_BYTES.labels(_endpoint(scope)).inc(sent)
+
+
+def _endpoint(scope) -> str:
+    endpoint = scope.get('endpoint')
+    return getattr(endpoint, '__name__', 'unmatched')
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, DateTime, create_engine, inspect, text
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Text, ForeignKey, DateTime, Table, create_engine, inspect, text
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime, timezone
 import logging
@@ -8,6 +8,14 @@ logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Episodes shared between feeds: a track (and its file) belongs to one user
+# and can be listed in any number of that user's feeds
+feed_tracks = Table(
+    'feed_tracks', Base.metadata,
+    Column('feed_id', Integer, ForeignKey('feeds.id', ondelete='CASCADE'), primary_key=True),
+    Column('track_id', Integer, ForeignKey('tracks.id', ondelete='CASCADE'), primary_key=True, index=True),
+)
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -17,7 +25,11 @@ class User(Base):
     uuid = Column(String, unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     image = Column(Boolean, nullable=False, default=False)
+    language = Column(String, nullable=True)  # preferred locale code, also used for the feed
+    current_feed_id = Column(Integer, nullable=True)  # feed the bot adds new videos to
     tracks = relationship("Track", back_populates="user", cascade="all, delete-orphan")
+    feeds = relationship("Feed", back_populates="user", cascade="all, delete-orphan", order_by="Feed.id")
+    jobs = relationship("DownloadJob", back_populates="user", cascade="all, delete-orphan")
 
 class Track(Base):
     __tablename__ = 'tracks'
@@ -25,13 +37,56 @@ class Track(Base):
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     title = Column(String, nullable=False)
-    youtube_url = Column(String, nullable=False)
+    youtube_url = Column(String, nullable=True)  # None for uploaded files
     file_name = Column(String, nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
-    duration = Column(String)
+    duration = Column(Integer)  # seconds
+    bitrate = Column(Integer)  # bits per second
+    file_size = Column(BigInteger)  # bytes
     channel_name = Column(String, nullable=True)
     description = Column(Text, nullable=True)
+    chapters = Column(Text, nullable=True)  # JSON [{"startTime": seconds, "title": ...}], Podcasting 2.0 style
+    broken_at = Column(DateTime, nullable=True)  # set by integrity.py while the file is missing or damaged
     user = relationship("User", back_populates="tracks")
+    feeds = relationship("Feed", secondary=feed_tracks, back_populates="tracks")
+
+class Feed(Base):
+    """A podcast feed of a user.
+
+    Every user has a default feed whose uuid is the user's uuid, so feed
+    URLs and cover paths from before multiple feeds keep working.
+    """
+    __tablename__ = 'feeds'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    uuid = Column(String, unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
+    title = Column(String, nullable=True)
+    image = Column(Boolean, nullable=False, default=False)
+    profile = Column(String, nullable=False, default='standard')  # key of ingest.PROFILES
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    user = relationship("User", back_populates="feeds")
+    tracks = relationship("Track", secondary=feed_tracks, back_populates="feeds")
+
+class DownloadJob(Base):
+    """Download that was accepted but hasn't produced a Track yet.
+
+    Deleted in the same transaction that creates the Track, so rows left
+    after a restart are interrupted downloads to resume.
+    """
+    __tablename__ = 'download_jobs'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)  # group and channel ids don't fit in 32 bits
+    url = Column(String, nullable=False)
+    video_key = Column(String, nullable=False)
+    extractor = Column(String, nullable=True)  # None: YouTube, jobs from before other sites
+    profile = Column(String, nullable=False)
+    language = Column(String, nullable=True)
+    feed_id = Column(Integer, nullable=True)  # None: the user's default feed
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    user = relationship("User", back_populates="jobs")
 
 def _add_missing_columns(engine):
     """Add columns that exist in the models but not yet in the database.
@@ -51,8 +106,87 @@ def _add_missing_columns(engine):
                 logger.info(f"Auto-migration: adding column {table.name}.{column.name} ({col_type})")
                 conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
 
+def _create_default_feeds(engine):
+    """Give users from before multiple feeds their default feed.
+
+    The default feed reuses the user's uuid and cover and lists all of the
+    user's tracks that aren't in any feed yet. Idempotent, so it simply runs
+    on every start.
+    """
+    with engine.begin() as conn:
+        created = conn.execute(text(
+            "INSERT INTO feeds (user_id, uuid, image, profile, created_at) "
+            "SELECT id, uuid, image, 'standard', created_at FROM users "
+            "WHERE NOT EXISTS (SELECT 1 FROM feeds WHERE feeds.user_id = users.id)"
+        )).rowcount
+        if created:
+            logger.info(f"Auto-migration: created {created} default feeds")
+        conn.execute(text(
+            "INSERT INTO feed_tracks (feed_id, track_id) "
+            "SELECT feeds.id, tracks.id FROM tracks "
+            "JOIN users ON users.id = tracks.user_id "
+            "JOIN feeds ON feeds.uuid = users.uuid "
+            "WHERE NOT EXISTS (SELECT 1 FROM feed_tracks WHERE feed_tracks.track_id = tracks.id)"
+        ))
+        conn.execute(text(
+            "UPDATE users SET current_feed_id = (SELECT feeds.id FROM feeds WHERE feeds.uuid = users.uuid) "
+            "WHERE current_feed_id IS NULL"
+        ))
+
+# Searchable text of a track; the Postgres index and search.py must use the same expression
+TRACK_SEARCH_DOCUMENT = (
+    "to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(channel_name, '') || ' ' || "
+    "coalesce(description, ''))"
+)
+
+def _create_search_index(engine):
+    """Full-text index over track titles, channels and descriptions.
+
+    Postgres gets a GIN expression index, which the database keeps current
+    on every insert, update and delete. SQLite (development) gets an FTS5
+    table over `tracks` maintained by triggers; it is filled from the
+    existing rows when first created. Idempotent, runs on every start.
+    """
+    with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_tracks_search ON tracks USING GIN ({TRACK_SEARCH_DOCUMENT})"
+            ))
+        elif engine.dialect.name == 'sqlite':
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tracks_fts'"
+            )).first()
+            if exists:
+                return
+            logger.info("Auto-migration: creating full-text index tracks_fts")
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE tracks_fts USING fts5("
+                "title, channel_name, description, content='tracks', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER tracks_fts_insert AFTER INSERT ON tracks BEGIN "
+                "INSERT INTO tracks_fts (rowid, title, channel_name, description) "
+                "VALUES (new.id, new.title, new.channel_name, new.description); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER tracks_fts_delete AFTER DELETE ON tracks BEGIN "
+                "INSERT INTO tracks_fts (tracks_fts, rowid, title, channel_name, description) "
+                "VALUES ('delete', old.id, old.title, old.channel_name, old.description); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER tracks_fts_update AFTER UPDATE ON tracks BEGIN "
+                "INSERT INTO tracks_fts (tracks_fts, rowid, title, channel_name, description) "
+                "VALUES ('delete', old.id, old.title, old.channel_name, old.description); "
+                "INSERT INTO tracks_fts (rowid, title, channel_name, description) "
+                "VALUES (new.id, new.title, new.channel_name, new.description); END"
+            ))
+            conn.execute(text("INSERT INTO tracks_fts (tracks_fts) VALUES ('rebuild')"))
+
 def init_db(database_url):
     engine = create_engine(database_url)
     Base.metadata.create_all(engine)
     _add_missing_columns(engine)
+    _create_default_feeds(engine)
+    _create_search_index(engine)
     return engine
\ No newline at end of file
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from locales import get_text
+from utils import format_duration, format_size
+
+logger = logging.getLogger(__name__)
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    """Format ETA in seconds, "—" if unknown"""
+    if seconds is None:
+        return "—"
+    return format_duration(seconds)
+
+
+class DownloadProgress:
+    """Throttled Telegram status message fed by yt-dlp hooks.
+
+    yt-dlp calls the hooks from the download worker thread, so they only record
+    the latest state. A coroutine on the bot's event loop picks it up at most
+    once per `min_interval` seconds and edits every attached status message,
+    which keeps us well under Telegram's edit rate limits.
+    """
+
+    def __init__(self, message: Message, lang: str, min_interval: float = 3.0):
+        self.messages = [(message, lang)]
+        self.min_interval = min_interval
+        self._state = None
+        self._last_text = {}
+        self._task = None
+
+    def add_message(self, message: Message, lang: str):
+        """Attach another status message (duplicate request for the same job)"""
+        self.messages.append((message, lang))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def finish(self):
+        """Stop updating and remove the status messages"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for message, _ in self.messages:
+            try:
+                await message.delete()
+            except TelegramError as e:
+                logger.debug(f"Could not delete status message: {e}")
+
+    def progress_hook(self, d: dict):
+        """yt-dlp progress hook"""
+        if d['status'] != 'downloading':
+            return
+        downloaded = d.get('downloaded_bytes') or 0
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        percent = f"{downloaded / total * 100:.0f}%" if total else format_size(downloaded)
+        speed = f"{format_size(d['speed'])}/s" if d.get('speed') else "—"
+        self._state = ('download_progress', {'percent': percent, 'speed': speed, 'eta': format_eta(d.get('eta'))})
+
+    def postprocessor_hook(self, d: dict):
+        """yt-dlp postprocessor hook"""
+        if d['status'] == 'started' and d.get('postprocessor') in ('ExtractAudio', 'TrimAudio'):
+            self._state = ('download_converting', {})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.min_interval)
+            if self._state is None:
+                continue
+            key, kwargs = self._state
+            for message, lang in list(self.messages):
+                await self._edit(message, get_text(lang, key, **kwargs))
+
+    async def _edit(self, message: Message, text: str):
+        if self._last_text.get(message.message_id) == text:
+            return
+        try:
+            await message.edit_text(text)
+            self._last_text[message.message_id] = text
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            logger.warning(f"Telegram flood control, pausing progress updates for {delay}s")
+            await asyncio.sleep(delay)
+        except BadRequest as e:
+            # "Message is not modified" and friends - nothing to do
+            logger.debug(f"Could not edit status message: {e}")
+        except TelegramError as e:
+            logger.warning(f"Error updating status message: {e}")
@@ -0,0 +1,166 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from metrics import RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+# Token bucket in Redis: KEYS[1] bucket, ARGV rate (tokens/s) and capacity.
+# Returns seconds until a token is available, "0" if one was taken.
+_REDIS_TAKE = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class MemoryBackend:
+    """Token buckets of this process, least recently used ones are dropped beyond `maxsize`
+
+    A dropped bucket was idle, so it would have refilled anyway; the only
+    cost of eviction is that a client coming back starts with a full bucket.
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, capacity: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBackend:
+    """Token buckets shared between processes (needs the optional `redis` package)"""
+
+    def __init__(self, url: str):
+        import redis.asyncio
+
+        self.client = redis.asyncio.Redis.from_url(url)
+        self.script = self.client.register_script(_REDIS_TAKE)
+
+    async def take(self, key: str, rate: float, capacity: int) -> float:
+        try:
+            return float(await self.script(keys=[f"ratelimit:{key}"], args=[rate, capacity]))
+        except Exception as e:
+            # An outage of the limiter must not take the service down with it
+            logger.warning(f"Rate limit backend failed, letting the request through: {e}")
+            return 0.0
+
+
+_backend = None
+
+
+def get_backend():
+    """Redis if RATE_LIMIT_REDIS_URL is set, otherwise in-memory buckets"""
+    global _backend
+    if _backend is None:
+        url = os.getenv("RATE_LIMIT_REDIS_URL")
+        _backend = RedisBackend(url) if url else MemoryBackend()
+    return _backend
+
+
+def parse_rate(spec: str) -> tuple:
+    """Parse "count/seconds" into (tokens per second, capacity); "0" or "" disables the limit"""
+    count, _, seconds = spec.strip().partition('/')
+    count = int(count or 0)
+    if count <= 0:
+        return 0.0, 0
+    return count / float(seconds or 1), count
+
+
+class RateLimiter:
+    """Token bucket per key: `count` requests at once, refilled at count/seconds
+
+    Configured with a "count/seconds" spec, e.g. "30/60" allows bursts of
+    30 and 30 requests a minute on average.
+    """
+
+    def __init__(self, name: str, spec: str):
+        self.name = name
+        self.rate, self.capacity = parse_rate(spec)
+
+    async def hit(self, key: Hashable) -> float:
+        """Take a token for `key`; seconds to wait if there is none, 0 if the request may proceed"""
+        if not self.rate:
+            return 0.0
+        wait = await get_backend().take(f"{self.name}:{key}", self.rate, self.capacity)
+        if wait:
+            RATE_LIMITED.labels(self.name).inc()
+        return wait
+
+
+# Telegram updates per user, and the heavier downloads and uploads on top of that
+bot_limiter = RateLimiter('bot', os.getenv("RATE_LIMIT_BOT", "30/60"))
+ingest_limiter = RateLimiter('ingest', os.getenv("RATE_LIMIT_INGEST", "10/600"))
+# HTTP requests per client IP, and per feed/user uuid across all clients. The per-IP limit is
+# off unless the proxy is trusted: otherwise every client has the proxy's address and shares one bucket
+client_limiter = RateLimiter('http', os.getenv("RATE_LIMIT_HTTP", "600/60" if os.getenv("FORWARDED_ALLOW_IPS") else "0"))
+uuid_limiter = RateLimiter('uuid', os.getenv("RATE_LIMIT_UUID", "300/60"))
+
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 to clients over the per-IP limit
+
+    The client address comes from uvicorn, which takes it from
+    X-Forwarded-For when the proxy is in FORWARDED_ALLOW_IPS.
+    """
+
+    exempt_paths = ('/metrics',)
+
+    def __init__(self, app, limiter: Optional[RateLimiter] = None):
+        self.app = app
+        self.limiter = limiter or client_limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.exempt_paths or not scope.get('client'):
+            await self.app(scope, receive, send)
+            return
+
+        wait = await self.limiter.hit(scope['client'][0])
+        if not wait:
+            await self.app(scope, receive, send)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 429,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'retry-after', str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': json.dumps({'detail': "Too many requests"}).encode()})
@@ -0,0 +1,52 @@
+import re
+
+from sqlalchemy import literal_column, or_, select, text
+from sqlalchemy.orm import Query, Session
+
+from models import TRACK_SEARCH_DOCUMENT, Track
+
+# Longer queries only make the index lookup slower without narrowing much
+MAX_TERMS = 8
+
+# Letters and digits; underscores split words like the Postgres and FTS5 tokenizers do
+_TERM_RE = re.compile(r'[^\W_]+')
+
+
+def search_terms(query: str) -> list[str]:
+    """Words of a user's query, lower-cased; punctuation and operators are dropped"""
+    return _TERM_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def filter_search(session: Session, query: Query, search: str) -> Query:
+    """Narrow a Track query to tracks whose title, channel or description match `search`.
+
+    Every word must match, the last one as a prefix, so results show up
+    while the user is still typing. Uses the full-text index from
+    models._create_search_index; other databases fall back to a LIKE scan.
+    """
+    terms = search_terms(search)
+    if not terms:
+        return query
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        tsquery = ' & '.join(terms[:-1] + [f"{terms[-1]}:*"])
+        return query.filter(
+            text(f"{TRACK_SEARCH_DOCUMENT} @@ to_tsquery('simple', :tsquery)").bindparams(tsquery=tsquery)
+        )
+    if dialect == 'sqlite':
+        fts_query = ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+        matches = (
+            select(literal_column('rowid'))
+            .select_from(text('tracks_fts'))
+            .where(text('tracks_fts MATCH :fts_query').bindparams(fts_query=fts_query))
+        )
+        return query.filter(Track.id.in_(matches))
+    for term in terms:
+        pattern = f"%{term}%"
+        query = query.filter(or_(
+            Track.title.ilike(pattern),
+            Track.channel_name.ilike(pattern),
+            Track.description.ilike(pattern),
+        ))
+    return query
+
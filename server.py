@@ -1,50 +1,78 @@
-from fastapi import FastAPI, HTTPException, Depends, APIRouter
-from fastapi.responses import FileResponse, Response
+from fastapi import FastAPI, HTTPException, Depends, APIRouter, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
 from sqlalchemy.orm import Session
-from models import User, Track, init_db
+from models import Feed, Track, feed_tracks
+from database import SessionLocal, get_db, init_database
+from api import router as api_router
+from utils import format_duration
+from chapters import chapters_document
+from locales import get_locale, get_text
+from cache import feed_cache, missing_feeds, missing_files, user_cache
+from logs import AccessLogMiddleware
+from ratelimit import RateLimitMiddleware, ingest_limiter, uuid_limiter
+from metrics import FEED_BUILD_SECONDS, MetricsMiddleware
+from ingest import remove_staging, staging_dir
+from uploads import MAX_UPLOAD_BYTES, UploadError, UploadTooLarge, process_upload, receive_upload, verify_upload_token
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import os
+import html
+import math
+import uuid as uuid_lib
 from datetime import datetime, timezone
 import xml.etree.ElementTree as ET
 from typing import Optional
-from sqlalchemy.orm import sessionmaker
+from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
-app = FastAPI()
 
-# Initialize database and create session factory
-engine = init_db(os.getenv("DATABASE_URL"))
-SessionLocal = sessionmaker(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(init_database)
+    yield
 
-# Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
-def build_item_description(track: Track) -> str:
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(AccessLogMiddleware)
+app.include_router(api_router)
+
+FEED_DEFAULT_LANGUAGE = 'ru'
+
+async def limit_uuid(uuid: str):
+    """Per-uuid limit on top of the per-IP one, for clients spread over many addresses"""
+    wait = await uuid_limiter.hit(uuid)
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(wait))})
+
+def build_item_description(track: Track, lang: str) -> str:
     lines = []
     if track.channel_name:
-        lines.append(f"Канал: {track.channel_name}")
-    lines.append(f"Ссылка на видео: {track.youtube_url}")
+        lines.append(get_text(lang, 'feed_channel', channel=track.channel_name))
+    if track.youtube_url:
+        lines.append(get_text(lang, 'feed_video_link', url=track.youtube_url))
     if track.description:
         lines.append("")
-        lines.append(f"Описание: {track.description}")
+        lines.append(get_text(lang, 'feed_description', description=track.description))
     return "\n".join(lines)
 
-def create_rss_feed(user: User, tracks: list[Track], domain: str) -> str:
+def create_rss_feed(feed: Feed, tracks: list[Track], domain: str) -> str:
+    user = feed.user
+    # Feeds were Russian-only before users had a language, keep that for them
+    locale = get_locale(user.language or FEED_DEFAULT_LANGUAGE)
     rss = ET.Element("rss", version="2.0", 
                     attrib={"xmlns:itunes": "http://www.itunes.com/dtds/podcast-1.0.dtd",
-                           "xmlns:content": "http://purl.org/rss/1.0/modules/content/"})
+                           "xmlns:content": "http://purl.org/rss/1.0/modules/content/",
+                           "xmlns:podcast": "https://podcastindex.org/namespace/1.0"})
     channel = ET.SubElement(rss, "channel")
     
     # Основные теги
-    ET.SubElement(channel, "title").text = f"Podcast Feed by @{user.username}"
+    ET.SubElement(channel, "title").text = feed.title or f"Podcast Feed by @{user.username}"
     ET.SubElement(channel, "link").text = f"https://app.sboychenko.ru/y2p"
     ET.SubElement(channel, "description").text = "Create with tg bot @YouTubeToPodcastBot"
-    ET.SubElement(channel, "language").text = "ru-ru"
+    ET.SubElement(channel, "language").text = locale.feed_language
     ET.SubElement(channel, "lastBuildDate").text = datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
     
     # iTunes специфичные теги
@@ -57,20 +85,33 @@ def create_rss_feed(user: User, tracks: list[Track], domain: str) -> str:
     #ET.SubElement(channel.find("itunes:owner"), "itunes:email").text = "your-email@example.com"  # Можно добавить в модель User
 
     # Обложка подкаста
-    if user.image:
+    if feed.image:
         image = ET.SubElement(channel, "image")
-        ET.SubElement(image, "url").text = f"https://{domain}/image/{user.uuid}.jpg"
+        ET.SubElement(image, "url").text = f"https://{domain}/image/{feed.uuid}.jpg"
         ET.SubElement(image, "title").text = f"Podcast Feed for User {user.telegram_id}"
-        ET.SubElement(image, "link").text = f"https://{domain}/rss/{user.uuid}"
+        ET.SubElement(image, "link").text = f"https://{domain}/rss/{feed.uuid}"
         # iTunes обложка
-        ET.SubElement(channel, "itunes:image", href=f"https://{domain}/image/{user.uuid}.jpg")
+        ET.SubElement(channel, "itunes:image", href=f"https://{domain}/image/{feed.uuid}.jpg")
 
     for track in tracks:
-        item_description = build_item_description(track)
+        # The integrity scanner brings the episode back once its file is restored
+        if track.broken_at is not None:
+            continue
+        file_size = track.file_size
+        if file_size is None:
+            # Not backfilled yet
+            try:
+                file_size = os.path.getsize(f"data/{user.uuid}/{track.file_name}")
+            except OSError:
+                logger.warning(f"Leaving track {track.id} without a file out of feed {feed.uuid}")
+                continue
+
+        item_description = build_item_description(track, locale.code)
 
         item = ET.SubElement(channel, "item")
         ET.SubElement(item, "title").text = track.title
-        ET.SubElement(item, "link").text = track.youtube_url
+        if track.youtube_url:
+            ET.SubElement(item, "link").text = track.youtube_url
         ET.SubElement(item, "description").text = item_description
         ET.SubElement(item, "pubDate").text = track.created_at.strftime("%a, %d %b %Y %H:%M:%S GMT")
         ET.SubElement(item, "guid").text = track.file_name
@@ -79,41 +120,64 @@ def create_rss_feed(user: User, tracks: list[Track], domain: str) -> str:
         ET.SubElement(item, "itunes:author").text = f"{track.channel_name or user.username}"
         ET.SubElement(item, "itunes:summary").text = item_description
         ET.SubElement(item, "itunes:explicit").text = "no"
-        ET.SubElement(item, "itunes:duration").text = f"{track.duration}"  # Можно добавить длительность в модель Track
+        if track.duration is not None:
+            ET.SubElement(item, "itunes:duration").text = format_duration(track.duration)
         
         enclosure = ET.SubElement(item, "enclosure")
         enclosure.set("url", f"https://{domain}/audio/{user.uuid}/{track.file_name}")
         enclosure.set("type", "audio/mpeg")
-        enclosure.set("length", str(os.path.getsize(f"data/{user.uuid}/{track.file_name}")))
+        enclosure.set("length", str(file_size))
+
+        if track.chapters:
+            ET.SubElement(item, "podcast:chapters",
+                          url=f"https://{domain}/chapters/{user.uuid}/{track.file_name}",
+                          type="application/json+chapters")
 
     return ET.tostring(rss, encoding="unicode")
 
 @app.get("/rss/{uuid}")
 async def get_rss_feed(uuid: str, db: Session = Depends(get_db)):
-    logger.info(f"Received RSS feed request for UUID: {uuid}")
-    user = db.query(User).filter_by(uuid=uuid).first()
-    if not user:
-        logger.error(f"User not found for UUID: {uuid}")
-        raise HTTPException(status_code=404, detail="User not found")
+    logger.debug(f"Received RSS feed request for UUID: {uuid}")
+    await limit_uuid(uuid)
+    rss_content = feed_cache.get(uuid)
+    if rss_content is None:
+        if missing_feeds.get(uuid):
+            raise HTTPException(status_code=404, detail="Feed not found")
+        feed = db.query(Feed).filter_by(uuid=uuid).first()
+        if not feed:
+            logger.error(f"Feed not found for UUID: {uuid}")
+            missing_feeds.set(uuid, True)
+            raise HTTPException(status_code=404, detail="Feed not found")
 
-    tracks = db.query(Track).filter_by(user_id=user.id).order_by(Track.created_at.desc()).all()
-    logger.info(f"Found {len(tracks)} tracks for user {user.telegram_id}")
-    
-    domain = os.getenv("DOMAIN")
-    logger.info(f"Using domain: {domain}")
-    
-    rss_content = create_rss_feed(user, tracks, domain)
+        tracks = (
+            db.query(Track)
+            .join(feed_tracks)
+            .filter(feed_tracks.c.feed_id == feed.id)
+            .order_by(Track.created_at.desc())
+            .all()
+        )
+        logger.debug(f"Found {len(tracks)} tracks for feed {feed.id}")
+
+        domain = os.getenv("DOMAIN")
+
+        with FEED_BUILD_SECONDS.time():
+            rss_content = create_rss_feed(feed, tracks, domain)
+        feed_cache.set(uuid, rss_content)
     return Response(content=rss_content, media_type="application/xml")
 
 @app.get("/audio/{user_uuid}/{file_name}")
 async def get_audio(user_uuid: str, file_name: str, db: Session = Depends(get_db)):
     """Get audio file"""
-    user = db.query(User).filter_by(uuid=user_uuid).first()
+    await limit_uuid(user_uuid)
+    user = user_cache.get_by_uuid(db, user_uuid)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-        
+
+    if missing_files.get((user_uuid, file_name)):
+        raise HTTPException(status_code=404, detail="Track not found")
     track = db.query(Track).filter_by(user_id=user.id, file_name=file_name).first()
     if not track:
+        missing_files.set((user_uuid, file_name), True)
         raise HTTPException(status_code=404, detail="Track not found")
         
     file_path = f"data/{user_uuid}/{track.file_name}"
@@ -122,9 +186,93 @@ async def get_audio(user_uuid: str, file_name: str, db: Session = Depends(get_db
         
     return FileResponse(file_path)
 
+@app.get("/chapters/{user_uuid}/{file_name}")
+async def get_chapters(user_uuid: str, file_name: str, db: Session = Depends(get_db)):
+    """Podcasting 2.0 chapters of a track"""
+    await limit_uuid(user_uuid)
+    user = user_cache.get_by_uuid(db, user_uuid)
+    track = db.query(Track).filter_by(user_id=user.id, file_name=file_name).first() if user else None
+    if not track or not track.chapters:
+        raise HTTPException(status_code=404, detail="Chapters not found")
+    return JSONResponse(chapters_document(track.chapters), media_type="application/json+chapters")
+
+# Feed covers live in data/{feed uuid}/; for default feeds that's the user's directory
 @app.get("/image/{user_uuid}.jpg")
 async def get_user_image(user_uuid: str):
     image_path = f"data/{user_uuid}/image.jpg"
     if not os.path.exists(image_path):
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(image_path, media_type="image/jpeg")
\ No newline at end of file
+    return FileResponse(image_path, media_type="image/jpeg")
+
+UPLOAD_FORM = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1"><title>Upload to {title}</title></head>
+<body>
+<h1>Upload to {title}</h1>
+<form method="post" enctype="multipart/form-data">
+<p><input type="file" name="file" accept="audio/*,video/*" required></p>
+<p><input type="text" name="title" placeholder="Episode title (optional)" size="40"></p>
+<p><button type="submit">Upload</button></p>
+</form>
+</body>
+</html>
+"""
+
+def get_upload_feed(token: str, db: Session) -> Feed:
+    feed_uuid = verify_upload_token(token)
+    feed = db.query(Feed).filter_by(uuid=feed_uuid).first() if feed_uuid else None
+    if not feed:
+        raise HTTPException(status_code=403, detail="Upload link is invalid or expired")
+    return feed
+
+@app.get("/upload/{token}")
+async def get_upload_form(token: str, db: Session = Depends(get_db)):
+    feed = get_upload_feed(token, db)
+    title = feed.title or f"Podcast Feed by @{feed.user.username}"
+    return HTMLResponse(UPLOAD_FORM.format(title=html.escape(title)))
+
+@app.post("/upload/{token}")
+async def upload_file(token: str, request: Request, db: Session = Depends(get_db)):
+    """Add an audio or video file to the feed the upload link was issued for
+
+    The multipart body is streamed to a staging directory as it arrives,
+    then probed, transcoded if needed and stored like a downloaded video.
+    """
+    feed = get_upload_feed(token, db)
+    feed_id, profile, owner_id = feed.id, feed.profile, feed.user.telegram_id
+    # Don't hold a pooled connection while the client is sending the file
+    db.close()
+
+    # Same RATE_LIMIT_INGEST bucket as the owner's downloads and uploads in the bot
+    wait = await ingest_limiter.hit(owner_id)
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many uploads", headers={"Retry-After": str(math.ceil(wait))})
+
+    if int(request.headers.get('content-length') or 0) > MAX_UPLOAD_BYTES + 64 * 1024:
+        raise HTTPException(status_code=413, detail="File is too large")
+
+    out_dir = staging_dir(f"upload-{uuid_lib.uuid4().hex}", profile)
+    try:
+        upload = await receive_upload(request.stream(), request.headers.get('content-type'), out_dir)
+        title = upload.fields.get('title', '').strip() or os.path.splitext(upload.filename)[0] or "Upload"
+        title, created = await asyncio.to_thread(process_upload, SessionLocal, feed_id, upload.path, title[:300])
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await asyncio.to_thread(remove_staging, out_dir)
+    logger.info(f"Stored upload '{title}' in feed {feed_id}", extra={'bytes': upload.size})
+    return {"title": title, "created": created}
+
+LIBRARY_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web", "library.html")
+
+@app.get("/library")
+async def get_library():
+    """Web UI for managing episodes; it authenticates to /api with the token in the URL fragment"""
+    return FileResponse(LIBRARY_PAGE, media_type="text/html")
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics; blocked for the outside world in nginx"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,479 @@
+"""Export and import the database and audio files, for moving to another host and for backups.
+
+Usage:
+    python snapshot.py export snapshot.tar.zst [--since previous.tar.zst.manifest.json] [--workers 4]
+    python snapshot.py import snapshot.tar.zst [--workers 8] [--verify] [--replace]
+
+An archive is a tar (optionally gzip or zstd compressed, by file extension
+or --compress) of the users, feeds and tracks tables as JSON lines, the
+audio files and covers they reference, and a manifest with row counts and
+SHA-256 checksums of everything. "-" streams to stdout / from stdin, so a
+host move needs no temporary archive:
+
+    python snapshot.py export - --compress zstd | ssh new-host 'cd bot && python snapshot.py import -'
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import IO, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import DateTime, func, select, text
+from sqlalchemy.engine import Engine
+
+from logs import setup_logging
+from models import Base, Feed, Track, User, init_db
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+# In insert order. Download jobs belong to the staging files of this host and aren't exported
+TABLES = ('users', 'feeds', 'tracks', 'feed_tracks')
+INSERT_BATCH = 1000
+# Table dumps up to this size stay in memory while streaming
+SPOOL_SIZE = 64 * 1024 * 1024
+COPY_BUFSIZE = 1024 * 1024
+
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class SnapshotError(Exception):
+    """Archive can't be written or doesn't match its manifest"""
+
+
+class _HashingReader:
+    """File wrapper that hashes what is read through it"""
+
+    def __init__(self, file: IO[bytes]):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.sha256.update(data)
+        return data
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise SnapshotError("zstd archives need the optional zstandard package: pip install zstandard")
+    return zstandard
+
+
+def archive_compression(path: str, compress: str = 'auto') -> str:
+    """'zstd', 'gzip' or 'none'; 'auto' goes by the file extension"""
+    if compress != 'auto':
+        return compress
+    if path.endswith(('.zst', '.zstd')):
+        return 'zstd'
+    if path.endswith(('.gz', '.tgz')):
+        return 'gzip'
+    return 'none'
+
+
+@contextmanager
+def _archive_writer(path: str, compression: str, workers: int):
+    """Streaming tar writer to `path` ("-" for stdout); a file only appears under `path` once complete"""
+    tmp_path = None
+    if path == '-':
+        raw = sys.stdout.buffer
+    else:
+        tmp_path = f"{path}.tmp"
+        raw = open(tmp_path, 'wb')
+    try:
+        stream = raw
+        if compression == 'zstd':
+            stream = _zstandard().ZstdCompressor(level=3, threads=workers).stream_writer(raw, closefd=False)
+        with tarfile.open(fileobj=stream, mode='w|gz' if compression == 'gzip' else 'w|',
+                          format=tarfile.PAX_FORMAT) as tar:
+            yield tar
+        if stream is not raw:
+            stream.close()
+        raw.flush()
+    except BaseException:
+        if tmp_path:
+            raw.close()
+            os.remove(tmp_path)
+        raise
+    if tmp_path:
+        os.fsync(raw.fileno())
+        raw.close()
+        os.replace(tmp_path, path)
+
+
+@contextmanager
+def _archive_reader(path: str):
+    """Streaming tar reader of `path` ("-" for stdin), compression is detected from the content"""
+    raw = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    try:
+        magic = raw.peek(4)[:4]
+        stream = raw
+        if magic == _ZSTD_MAGIC:
+            stream = _zstandard().ZstdDecompressor().stream_reader(raw, closefd=False)
+        with tarfile.open(fileobj=stream, mode='r|gz' if magic.startswith(_GZIP_MAGIC) else 'r|') as tar:
+            yield tar
+    finally:
+        if raw is not sys.stdin.buffer:
+            raw.close()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't export {type(value).__name__}")
+
+
+def _dump_table(conn, table) -> tuple[IO[bytes], int, str]:
+    """Rows of `table` as JSON lines in a temporary file; returns the file, row count and checksum"""
+    dump = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    sha256 = hashlib.sha256()
+    rows = 0
+    result = conn.execution_options(stream_results=True, yield_per=INSERT_BATCH).execute(
+        table.select().order_by(*table.primary_key.columns)
+    )
+    for row in result:
+        line = json.dumps(dict(row._mapping), default=_json_default, ensure_ascii=False).encode() + b'\n'
+        dump.write(line)
+        sha256.update(line)
+        rows += 1
+    dump.seek(0)
+    return dump, rows, sha256.hexdigest()
+
+
+def _snapshot_files(conn) -> list[str]:
+    """Audio files and covers referenced by the database, relative to the working directory"""
+    paths = [f"data/{user_uuid}/{file_name}"
+             for user_uuid, file_name in conn.execute(select(User.uuid, Track.file_name).join(Track))]
+    # Default feeds share the user's uuid, so their covers are listed twice
+    paths += [f"data/{feed_uuid}/image.jpg" for (feed_uuid,) in conn.execute(select(Feed.uuid).where(Feed.image))]
+    return list(dict.fromkeys(paths))
+
+
+def export_snapshot(engine: Engine, path: str, compression: str = 'none', workers: int = 4,
+                    since: Optional[dict] = None) -> dict:
+    """Write a snapshot archive of the database and its files to `path`.
+
+    Tables are read in one repeatable-read transaction (on Postgres) and
+    the file list comes from that same read, so the archive is consistent
+    even while the bot keeps running; files deleted in the meantime are
+    skipped. Hard-linked files are stored once.
+
+    Args:
+        engine: Database to export
+        path: Archive file, "-" for stdout
+        compression: 'none', 'gzip' or 'zstd'
+        workers: zstd compression threads
+        since: Manifest of an earlier snapshot; files whose size and mtime
+            haven't changed since are left out and only listed in the manifest
+
+    Returns:
+        dict: The manifest, also stored as the last member of the archive
+    """
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'base': since['created_at'] if since else None,
+        'tables': {},
+        'files': {},
+    }
+    previous = since['files'] if since else {}
+    included = skipped = 0
+    with _archive_writer(path, compression, workers) as tar:
+        with engine.connect() as conn:
+            if engine.dialect.name == 'postgresql':
+                conn = conn.execution_options(isolation_level='REPEATABLE READ')
+            with conn.begin():
+                for name in TABLES:
+                    dump, rows, checksum = _dump_table(conn, Base.metadata.tables[name])
+                    with dump:
+                        info = tarfile.TarInfo(f"db/{name}.jsonl")
+                        info.size = dump.seek(0, os.SEEK_END)
+                        info.mtime = int(datetime.now().timestamp())
+                        dump.seek(0)
+                        tar.addfile(info, dump)
+                    manifest['tables'][name] = {'rows': rows, 'sha256': checksum}
+                files = _snapshot_files(conn)
+
+        for file_path in files:
+            try:
+                file = open(file_path, 'rb')
+            except FileNotFoundError:
+                logger.warning(f"Skipping missing file {file_path}")
+                continue
+            with file:
+                stat = os.fstat(file.fileno())
+                entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+                known = previous.get(file_path)
+                if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+                    manifest['files'][file_path] = {**entry, 'sha256': known['sha256'], 'included': False}
+                    skipped += 1
+                    continue
+
+                # tarfile turns further names of a hard-linked file into links to the first one
+                info = tar.gettarinfo(arcname=file_path, fileobj=file)
+                if info.islnk():
+                    tar.addfile(info)
+                    entry['sha256'] = manifest['files'][info.linkname]['sha256']
+                else:
+                    reader = _HashingReader(file)
+                    tar.addfile(info, reader)
+                    entry['sha256'] = reader.sha256.hexdigest()
+            manifest['files'][file_path] = {**entry, 'included': True}
+            included += 1
+            if included % 500 == 0:
+                logger.info(f"Exported {included} files")
+
+        data = json.dumps(manifest, indent=1).encode()
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        info.mtime = int(datetime.now().timestamp())
+        tar.addfile(info, io.BytesIO(data))
+
+    logger.info(f"Exported {manifest['tables']['tracks']['rows']} tracks, {included} files "
+                f"({skipped} unchanged since the previous snapshot)")
+    return manifest
+
+
+def _file_member_path(name: str) -> str:
+    """Validated "data/<dir>/<file>" member name; anything else could write outside the data directory"""
+    parts = name.split('/')
+    if len(parts) != 3 or parts[0] != 'data' or any(part in ('', '.', '..') for part in parts) or '\\' in name:
+        raise SnapshotError(f"Unexpected archive member {name}")
+    return name
+
+
+def _tmp_path(file_path: str) -> str:
+    # The janitor removes these if the import dies halfway
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}.tmp")
+
+
+def _finish_file(tmp_path: str, mtime_ns: int):
+    with open(tmp_path, 'rb+') as file:
+        os.fsync(file.fileno())
+    os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+
+
+def _file_checksum(file_path: str) -> Optional[str]:
+    sha256 = hashlib.sha256()
+    try:
+        with open(file_path, 'rb') as file:
+            while chunk := file.read(COPY_BUFSIZE):
+                sha256.update(chunk)
+    except FileNotFoundError:
+        return None
+    return sha256.hexdigest()
+
+
+def _load_rows(conn, table, dump: IO[bytes]) -> int:
+    dates = {column.name for column in table.columns if isinstance(column.type, DateTime)}
+    rows = 0
+    batch = []
+    for line in dump:
+        row = {key: value for key, value in json.loads(line).items() if key in table.c}
+        for key in dates & row.keys():
+            if row[key] is not None:
+                row[key] = datetime.fromisoformat(row[key])
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH:
+            conn.execute(table.insert(), batch)
+            rows += len(batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+        rows += len(batch)
+    return rows
+
+
+def import_snapshot(engine: Engine, path: str, workers: int = 8, verify: bool = False,
+                    replace: bool = False) -> dict:
+    """Restore a snapshot archive from `path` ("-" for stdin).
+
+    Files are extracted next to their destination under temporary names
+    while the archive streams in, and fsynced by `workers` threads. Nothing
+    is published before every table and file matched the manifest; then
+    the files are renamed into place and the tables are replaced in one
+    transaction. Files an incremental snapshot left out must already be
+    here from an earlier import: their size is checked, and their checksum
+    with `verify`. Stop the bot while importing.
+
+    Args:
+        engine: Database to import into
+        path: Archive file, "-" for stdin
+        workers: Threads that fsync extracted files and verify existing ones
+        verify: Also checksum files already here that the snapshot left out
+        replace: Allow replacing a database that already has users
+
+    Returns:
+        dict: Imported row counts per table, and numbers of files imported and kept
+    """
+    with engine.connect() as conn:
+        has_users = conn.execute(select(func.count()).select_from(User)).scalar()
+    if has_users and not replace:
+        raise SnapshotError("The database already has users, pass --replace to overwrite it")
+
+    dumps = {}
+    extracted = {}  # file path -> (temporary path, checksum)
+    manifest = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        try:
+            with _archive_reader(path) as tar:
+                for member in tar:
+                    if member.name == MANIFEST_NAME:
+                        manifest = json.load(tar.extractfile(member))
+                    elif member.name.startswith('db/'):
+                        name = member.name[len('db/'):-len('.jsonl')]
+                        if member.name != f"db/{name}.jsonl" or name not in TABLES:
+                            raise SnapshotError(f"Unexpected archive member {member.name}")
+                        dump = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+                        reader = _HashingReader(tar.extractfile(member))
+                        while chunk := reader.read(COPY_BUFSIZE):
+                            dump.write(chunk)
+                        dump.seek(0)
+                        dumps[name] = (dump, reader.sha256.hexdigest())
+                    elif member.islnk():
+                        file_path = _file_member_path(member.name)
+                        target = extracted.get(_file_member_path(member.linkname))
+                        if target is None:
+                            raise SnapshotError(f"{member.name} links to a file not in the archive")
+                        tmp_path = _tmp_path(file_path)
+                        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                        if os.path.lexists(tmp_path):
+                            os.remove(tmp_path)
+                        os.link(target[0], tmp_path)
+                        extracted[file_path] = (tmp_path, target[1])
+                    elif member.isfile():
+                        file_path = _file_member_path(member.name)
+                        tmp_path = _tmp_path(file_path)
+                        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                        extracted[file_path] = (tmp_path, None)
+                        reader = _HashingReader(tar.extractfile(member))
+                        with open(tmp_path, 'wb') as file:
+                            while chunk := reader.read(COPY_BUFSIZE):
+                                file.write(chunk)
+                        extracted[file_path] = (tmp_path, reader.sha256.hexdigest())
+                        pending.append(pool.submit(_finish_file, tmp_path, int(member.mtime * 1e9)))
+                        if len(extracted) % 500 == 0:
+                            logger.info(f"Extracted {len(extracted)} files")
+                    else:
+                        raise SnapshotError(f"Unexpected archive member {member.name}")
+
+            if manifest is None:
+                raise SnapshotError("The archive has no manifest, it is probably truncated")
+            if manifest.get('version') != MANIFEST_VERSION:
+                raise SnapshotError(f"Unsupported snapshot version {manifest.get('version')}")
+            for future in pending:
+                future.result()
+
+            problems = [f"table {name}" for name, table in manifest['tables'].items()
+                        if name not in dumps or dumps[name][1] != table['sha256']]
+            kept = {file_path: entry for file_path, entry in manifest['files'].items() if not entry['included']}
+            for file_path, entry in manifest['files'].items():
+                if entry['included'] and extracted.get(file_path, (None, None))[1] != entry['sha256']:
+                    problems.append(file_path)
+            problems += [file_path for file_path in extracted if file_path not in manifest['files']]
+            for file_path, entry in list(kept.items()):
+                if not os.path.exists(file_path) or os.path.getsize(file_path) != entry['size']:
+                    problems.append(f"{file_path} (left out of this incremental snapshot, missing or changed here)")
+                    del kept[file_path]
+            if verify:
+                checksums = pool.map(_file_checksum, kept)
+                problems += [f"{file_path} (differs from the snapshot)"
+                             for (file_path, entry), checksum in zip(kept.items(), checksums)
+                             if checksum != entry['sha256']]
+            if problems:
+                raise SnapshotError(f"{len(problems)} entries don't match the manifest: {', '.join(problems[:10])}")
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+            for tmp_path, _ in extracted.values():
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            for dump, _ in dumps.values():
+                dump.close()
+            raise
+
+    # Files first, like store_track: if the database part fails, the janitor removes them as orphans
+    for file_path, (tmp_path, _) in extracted.items():
+        os.replace(tmp_path, file_path)
+
+    stats = {'tables': {}, 'files_imported': len(extracted), 'files_kept': len(kept)}
+    with engine.begin() as conn:
+        # Download jobs of the replaced users go too
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+        for name in TABLES:
+            dump, _ = dumps[name]
+            with dump:
+                stats['tables'][name] = _load_rows(conn, Base.metadata.tables[name], dump)
+        if engine.dialect.name == 'postgresql':
+            # Rows came with their ids, move the sequences past them
+            for name in TABLES:
+                if 'id' in Base.metadata.tables[name].c:
+                    conn.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                        f"COALESCE((SELECT MAX(id) FROM {name}), 0) + 1, false)"
+                    ))
+    logger.info(f"Imported {stats['tables']}, {len(extracted)} files ({len(kept)} kept from earlier imports)")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help="write a snapshot")
+    export_parser.add_argument('path', help='archive to write, "-" for stdout')
+    export_parser.add_argument('--since', help="manifest of an earlier snapshot, to only export changed files")
+    export_parser.add_argument('--manifest', help="where to also write the manifest (default: <path>.manifest.json)")
+    export_parser.add_argument('--compress', choices=('auto', 'none', 'gzip', 'zstd'), default='auto',
+                               help="compression, 'auto' goes by the extension of path")
+    export_parser.add_argument('--workers', type=int, default=4, help="zstd compression threads")
+    import_parser = commands.add_parser('import', help="restore a snapshot")
+    import_parser.add_argument('path', help='archive to read, "-" for stdin')
+    import_parser.add_argument('--workers', type=int, default=8, help="parallel file syncs and checks")
+    import_parser.add_argument('--verify', action='store_true',
+                               help="checksum files an incremental snapshot left out, not just their size")
+    import_parser.add_argument('--replace', action='store_true', help="replace a database that has users")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # stdout may be the archive
+    setup_logging(stream=sys.stderr)
+    engine = init_db(os.getenv("DATABASE_URL"))
+    try:
+        if args.command == 'export':
+            since = None
+            if args.since:
+                with open(args.since) as file:
+                    since = json.load(file)
+            manifest = export_snapshot(engine, args.path, archive_compression(args.path, args.compress),
+                                       args.workers, since)
+            manifest_path = args.manifest or (f"{args.path}.manifest.json" if args.path != '-' else None)
+            if manifest_path:
+                with open(manifest_path, 'w') as file:
+                    json.dump(manifest, file, indent=1)
+        else:
+            import_snapshot(engine, args.path, args.workers, args.verify, args.replace)
+    except (SnapshotError, tarfile.TarError) as e:
+        logger.error(f"Snapshot {args.command} failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
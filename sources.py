@@ -0,0 +1,164 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from metrics import DOWNLOADS_WAITING
+
+logger = logging.getLogger(__name__)
+
+_URL_RE = re.compile(r'https?://\S+')
+_YOUTUBE_HOSTS = {
+    'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com',
+    'youtu.be', 'www.youtu.be', 'youtube-nocookie.com', 'www.youtube-nocookie.com',
+}
+_YOUTUBE_ID_RE = re.compile(r'(?:youtu\.be/|[?&]v=|/shorts/|/live/|/embed/|/v/)([\w-]{11})(?![\w-])')
+_UNSAFE_CHARS_RE = re.compile(r'[^\w-]')
+
+
+class Source(NamedTuple):
+    """A media URL resolved to the yt-dlp extractor that handles it"""
+    extractor: str  # lower-cased yt-dlp extractor key, e.g. "youtube", "vimeo"
+    id: str
+    url: str  # canonical URL to download
+
+    @property
+    def key(self) -> str:
+        """Key for dedupe, staging directories and file names
+
+        The bare id for YouTube, so files from before other sites were
+        supported keep their names.
+        """
+        if self.extractor == 'youtube':
+            return self.id
+        return f"{self.extractor}-{_UNSAFE_CHARS_RE.sub('_', self.id)[:100]}"
+
+
+def find_url(text: str) -> Optional[str]:
+    """First http(s) URL in a message"""
+    match = _URL_RE.search(text or '')
+    return match.group(0) if match else None
+
+
+def is_youtube_url(url: str) -> bool:
+    return (urlsplit(url).hostname or '').lower() in _YOUTUBE_HOSTS
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Get YouTube video id from URL without hitting the network"""
+    if not is_youtube_url(url):
+        return None
+    match = _YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+@functools.lru_cache(maxsize=1)
+def _extractor_classes() -> tuple:
+    from yt_dlp.extractor import gen_extractor_classes
+
+    # The generic extractor matches every URL; we only take sites yt-dlp knows
+    return tuple(ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic')
+
+
+@functools.lru_cache(maxsize=1024)
+def classify_url(url: str) -> Optional[Source]:
+    """Resolve a URL to (extractor, id) without network access.
+
+    YouTube videos are recognized by a regex and get a canonical watch URL
+    (dropping playlist and tracking parameters). Other URLs are matched
+    against yt-dlp's extractors, which is CPU-bound on first use - call it
+    from a worker thread. Returns None if no extractor handles the URL or
+    the URL isn't known to be a single video.
+    """
+    if urlsplit(url).scheme not in ('http', 'https'):
+        return None
+
+    video_id = extract_video_id(url)
+    if video_id:
+        return Source('youtube', video_id, f"https://www.youtube.com/watch?v={video_id}")
+
+    for ie in _extractor_classes():
+        if ie.suitable(url):
+            # Playlists and channels would turn one message into many episodes. Extractors
+            # that may return either (like YouTube's tabs) or whose kind is unknown count too
+            if not ie.is_single_video(url):
+                return None
+            video_id = ie.get_temp_id(url) or hashlib.sha1(url.encode()).hexdigest()[:16]
+            return Source(ie.ie_key().lower(), video_id, url)
+    return None
+
+
+def _parse_allowed(spec: str) -> Optional[frozenset]:
+    names = frozenset(name.strip().lower() for name in spec.split(',') if name.strip())
+    return None if '*' in names else names
+
+
+# Extractors users may download from, "*" for every site yt-dlp supports
+ALLOWED_EXTRACTORS = _parse_allowed(os.getenv("ALLOWED_EXTRACTORS", "youtube"))
+
+
+def is_allowed(source: Source) -> bool:
+    return ALLOWED_EXTRACTORS is None or source.extractor in ALLOWED_EXTRACTORS
+
+
+class _Limiter:
+    def __init__(self, concurrency: int, per_minute: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.next_start = 0.0
+
+
+class ExtractorLimits:
+    """Per-extractor concurrency and start-rate limits for downloads.
+
+    `spec` is "extractor=concurrency:per_minute,...", e.g. "youtube=4:30";
+    extractors not listed get `default`. A per-minute rate of 0 means no
+    rate limit. Each extractor has its own queue, so a slow site only
+    delays downloads from that site.
+    """
+
+    def __init__(self, spec: str = '', default: tuple = (2, 12)):
+        self.default = default
+        self.limits = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            name, _, value = item.partition('=')
+            concurrency, _, per_minute = value.partition(':')
+            self.limits[name.strip().lower()] = (int(concurrency), float(per_minute or 0))
+        self._limiters = {}
+
+    def _limiter(self, extractor: str) -> _Limiter:
+        limiter = self._limiters.get(extractor)
+        if limiter is None:
+            limiter = _Limiter(*self.limits.get(extractor, self.default))
+            self._limiters[extractor] = limiter
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, extractor: str):
+        """Wait for a download slot of the extractor and hold it inside the block"""
+        limiter = self._limiter(extractor)
+        waiting = DOWNLOADS_WAITING.labels(extractor)
+        waiting.inc()
+        try:
+            await limiter.semaphore.acquire()
+            try:
+                now = time.monotonic()
+                start = max(now, limiter.next_start)
+                limiter.next_start = start + limiter.interval
+                if start > now:
+                    await asyncio.sleep(start - now)
+            except BaseException:
+                limiter.semaphore.release()
+                raise
+        finally:
+            waiting.dec()
+        try:
+            yield
+        finally:
+            limiter.semaphore.release()
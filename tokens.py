@@ -0,0 +1,39 @@
+import hashlib
+import hmac
+import os
+import time
+from typing import Optional
+
+
+def _signing_key() -> Optional[bytes]:
+    secret = os.getenv("UPLOAD_SECRET") or os.getenv("TELEGRAM_BOT_TOKEN")
+    return hashlib.sha256(secret.encode()).digest() if secret else None
+
+
+def _sign(payload: str, purpose: Optional[str]) -> str:
+    # The purpose is signed but not part of the token, so a token for one
+    # purpose can't be used for another
+    if purpose:
+        payload = f"{purpose}:{payload}"
+    # Hex keeps the token free of characters Telegram's Markdown would interpret
+    return hmac.new(_signing_key(), payload.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def make_token(subject: str, ttl: int, purpose: Optional[str] = None) -> str:
+    """Signed token for `subject` (a feed or user uuid) that expires in `ttl` seconds"""
+    payload = f"{subject}.{int(time.time()) + ttl}"
+    return f"{payload}.{_sign(payload, purpose)}"
+
+
+def verify_token(token: str, purpose: Optional[str] = None) -> Optional[str]:
+    """Subject the token was issued for, None if it is forged or expired"""
+    try:
+        subject, expires_at, signature = token.split('.')
+        expired = int(expires_at) < time.time()
+    except ValueError:
+        return None
+    if expired or _signing_key() is None:
+        return None
+    if not hmac.compare_digest(signature, _sign(f"{subject}.{expires_at}", purpose)):
+        return None
+    return subject
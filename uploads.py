@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import logging
+import os
+import subprocess
+import time
+from typing import AsyncIterator, NamedTuple, Optional
+
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+from sqlalchemy.orm import sessionmaker
+
+from cache import feed_cache
+from ingest import PROFILES, track_file_name
+from library import link_existing_track, store_track
+from metrics import INGESTS, TRANSCODE_SECONDS
+from models import Feed
+from tokens import make_token, verify_token
+from utils import format_size
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(1024 ** 3)))
+UPLOAD_LINK_TTL = 24 * 3600
+
+# File data is written to disk in batches of about this size
+_WRITE_BATCH = 1024 * 1024
+# Limit for the non-file form fields (title)
+_MAX_FIELD_BYTES = 4096
+_FILE = object()
+
+
+class UploadError(Exception):
+    """The upload can't be ingested; the message is safe to show to the user"""
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class ReceivedUpload(NamedTuple):
+    path: str
+    filename: Optional[str]
+    fields: dict
+    size: int
+
+
+class AudioInfo(NamedTuple):
+    duration: Optional[float]
+    bitrate: Optional[int]
+    is_mp3: bool
+
+
+def upload_token(feed_uuid: str, ttl: int = UPLOAD_LINK_TTL) -> str:
+    """Signed token that allows uploading files into the feed until it expires"""
+    return make_token(feed_uuid, ttl)
+
+
+def verify_upload_token(token: str) -> Optional[str]:
+    """Feed uuid the token was issued for, None if it is forged or expired"""
+    return verify_token(token)
+
+
+async def receive_upload(chunks: AsyncIterator[bytes], content_type: str, out_dir: str,
+                         max_bytes: int = MAX_UPLOAD_BYTES) -> ReceivedUpload:
+    """Stream the first file of a multipart/form-data body into `out_dir`.
+
+    The body is parsed as it arrives and file data is written in batches
+    from a worker thread, so memory use doesn't depend on the file size and
+    the event loop never waits for the disk. Other files in the body are
+    ignored; small text fields are returned in `fields`.
+    """
+    mime_type, params = parse_options_header(content_type or '')
+    boundary = params.get(b'boundary')
+    if mime_type != b'multipart/form-data' or not boundary:
+        raise UploadError("Expected a multipart/form-data upload")
+
+    headers = {}
+    header_field = bytearray()
+    header_value = bytearray()
+    fields = {}
+    pending = []
+    state = {'part': None, 'filename': None, 'size': 0, 'pending_bytes': 0}
+
+    def on_part_begin():
+        headers.clear()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        _, options = parse_options_header(headers.get(b'content-disposition', b''))
+        if b'filename' in options:
+            if state['filename'] is None:
+                state['part'] = _FILE
+                state['filename'] = options[b'filename'].decode('utf-8', 'replace')
+            else:
+                state['part'] = None
+        else:
+            name = options.get(b'name', b'').decode('utf-8', 'replace')
+            fields[name] = bytearray()
+            state['part'] = name
+
+    def on_part_data(data: bytes, start: int, end: int):
+        part = state['part']
+        if part is _FILE:
+            pending.append(data[start:end])
+            state['size'] += end - start
+            state['pending_bytes'] += end - start
+        elif part is not None:
+            if len(fields[part]) + end - start > _MAX_FIELD_BYTES:
+                raise UploadError(f"Form field '{part}' is too long")
+            fields[part].extend(data[start:end])
+
+    def on_part_end():
+        state['part'] = None
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+
+    async def flush():
+        data = b''.join(pending)
+        pending.clear()
+        state['pending_bytes'] = 0
+        await asyncio.to_thread(file.write, data)
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = f"{out_dir}/upload"
+    file = await asyncio.to_thread(open, path, 'wb')
+    try:
+        async for chunk in chunks:
+            try:
+                parser.write(chunk)
+            except ValueError as e:
+                raise UploadError("Malformed multipart body") from e
+            if state['size'] > max_bytes:
+                raise UploadTooLarge(f"File is larger than {format_size(max_bytes)}")
+            if state['pending_bytes'] >= _WRITE_BATCH:
+                await flush()
+        parser.finalize()
+        if pending:
+            await flush()
+    finally:
+        await asyncio.to_thread(file.close)
+
+    if state['filename'] is None:
+        raise UploadError("No file in the upload")
+    return ReceivedUpload(
+        path=path,
+        filename=state['filename'],
+        fields={name: value.decode('utf-8', 'replace') for name, value in fields.items()},
+        size=state['size'],
+    )
+
+
+def probe_audio(path: str) -> Optional[AudioInfo]:
+    """Duration and bitrate of an audio file, None if mutagen doesn't recognize it"""
+    import mutagen
+    from mutagen.mp3 import MP3
+
+    try:
+        audio = mutagen.File(path)
+    except mutagen.MutagenError:
+        return None
+    if audio is None or audio.info is None:
+        return None
+    return AudioInfo(
+        duration=getattr(audio.info, 'length', None),
+        bitrate=getattr(audio.info, 'bitrate', None) or None,
+        is_mp3=isinstance(audio, MP3),
+    )
+
+
+def transcode_to_mp3(src: str, dest: str, profile: str):
+    """Encode the audio stream of any ffmpeg-readable file to MP3 with the profile's bitrate"""
+    command = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', src, '-vn', '-codec:a', 'libmp3lame', '-b:a', f"{PROFILES[profile]['quality']}k", dest,
+    ]
+    start = time.perf_counter()
+    try:
+        subprocess.run(command, check=True, capture_output=True)
+    except FileNotFoundError as e:
+        raise UploadError("ffmpeg is not available") from e
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"ffmpeg failed on {src}: {e.stderr.decode('utf-8', 'replace').strip()[-500:]}")
+        raise UploadError("Not a supported audio or video file") from e
+    TRANSCODE_SECONDS.labels('upload').observe(time.perf_counter() - start)
+
+
+def process_upload(session_factory: sessionmaker, feed_id: int, src_path: str, title: str, **fields) -> tuple:
+    """Store an uploaded file as a Track of the feed. Blocking, run it in a worker thread.
+
+    MP3s at or below the bitrate of the feed's profile are kept as they are,
+    anything else is transcoded with the profile. Stored files are named by
+    content hash, so uploading the same file again only links the existing
+    track into the feed.
+
+    Returns:
+        tuple: (title, created) - created is False if the track already existed
+    """
+    session = session_factory()
+    try:
+        feed = session.get(Feed, feed_id)
+        user_id, user_uuid, feed_uuid, profile = feed.user_id, feed.user.uuid, feed.uuid, feed.profile
+
+        with open(src_path, 'rb') as f:
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        file_name = track_file_name(f"upload-{digest[:16]}", profile)
+
+        existing_title = link_existing_track(session, user_id, feed_id, file_name)
+        if existing_title is not None:
+            session.commit()
+            feed_cache.invalidate(feed_uuid)
+            INGESTS.labels('duplicate').inc()
+            return existing_title, False
+
+        info = probe_audio(src_path)
+        max_bitrate = int(PROFILES[profile]['quality']) * 1000
+        if info and info.is_mp3 and info.bitrate and info.bitrate <= max_bitrate:
+            staged_path = src_path
+        else:
+            staged_path = f"{os.path.dirname(src_path)}/audio.mp3"
+            transcode_to_mp3(src_path, staged_path, profile)
+            info = probe_audio(staged_path)
+        if info is None or not info.duration:
+            raise UploadError("Not a supported audio or video file")
+
+        store_track(
+            session, staged_path, user_uuid, feed_id,
+            user_id=user_id,
+            title=title,
+            youtube_url=None,
+            file_name=file_name,
+            duration=int(info.duration),
+            bitrate=info.bitrate,
+            file_size=os.path.getsize(staged_path),
+            **fields
+        )
+        INGESTS.labels('success').inc()
+        return title, True
+    except Exception:
+        INGESTS.labels('error').inc()
+        raise
+    finally:
+        session.close()
@@ -1,7 +1,9 @@
-from PIL import Image, ImageDraw, ImageFont
 import io
 import os
 
+from metrics import MEDIA_HELPER_SECONDS
+
+@MEDIA_HELPER_SECONDS.labels('podcast_cover').time()
 def process_podcast_cover(image: bytes, username: str) -> bytes:
     """
     Process podcast cover image: resize, add text and background.
@@ -11,6 +13,9 @@ def process_podcast_cover(image: bytes, username: str) -> bytes:
     Returns:
         Processed image as bytes
     """
+    # Pillow is only needed here, keep it out of the server's startup path
+    from PIL import Image, ImageDraw, ImageFont
+
     # Open image with Pillow
     image = Image.open(io.BytesIO(image))
     target_size = 512
@@ -67,6 +72,7 @@ def process_podcast_cover(image: bytes, username: str) -> bytes:
     result.save(img_byte_arr, format='JPEG')
     return img_byte_arr.getvalue()
 
+@MEDIA_HELPER_SECONDS.labels('user_storage').time()
 def calculate_user_storage(user_uuid: str) -> int:
     """Calculate total disk space used by user's audio files
     
@@ -98,4 +104,19 @@ def format_size(size_bytes: int) -> str:
         if size_bytes < 1024.0:
             return f"{size_bytes:.1f} {unit}"
         size_bytes /= 1024.0
-    return f"{size_bytes:.1f} GB"
\ No newline at end of file
+    return f"{size_bytes:.1f} GB"
+
+def format_duration(seconds: int) -> str:
+    """Format duration as H:MM:SS, or MM:SS for less than an hour
+
+    Args:
+        seconds: Duration in seconds
+
+    Returns:
+        str: Formatted duration (e.g. "1:02:03", "05:07")
+    """
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
\ No newline at end of file